@@ -0,0 +1,139 @@
+import torch
+import torch.nn.functional as F
+
+
+def head_behavior_scores(pattern: torch.Tensor, ids: torch.Tensor, lengths: torch.Tensor = None):
+    """Per-head copying / induction / self / previous-token scores for a batch.
+
+    pattern: [B, n_heads, T, T] attention patterns
+    ids: [B, T] token IDs
+    lengths: optional [B] number of real (unpadded) tokens in each sequence
+
+    For a query position i and an earlier position j holding the same token,
+    the copying score sums attention i -> j and the induction score sums
+    attention i -> j + 1 (the token that followed the earlier occurrence).
+    Both are normalized by the sequence length. The diagonal and previous-token
+    scores are the mean attention to position i and i - 1.
+
+    Returns a dict of [B, n_heads] float64 score tensors, plus the boolean
+    ``copying_mask`` and ``induction_mask`` ([B, T, T], indexed by query and
+    attended position) used to pick out examples.
+    """
+    B, n_heads, T, _ = pattern.shape
+    if lengths is None:
+        lengths = torch.full((B,), T, dtype=torch.long)
+    lengths = lengths.to(pattern.device)
+    pattern = pattern.double()
+
+    positions = torch.arange(T, device=pattern.device)
+    valid = positions[None, :] < lengths[:, None]  # [B, T]
+    earlier = positions[None, :] < positions[:, None]  # [T, T], key j before query i
+
+    # copying_mask[b, i, j]: token j is an earlier occurrence of token i
+    copying_mask = (ids[:, :, None] == ids[:, None, :]) & earlier & valid[:, :, None] & valid[:, None, :]
+    # induction_mask[b, i, j + 1] = copying_mask[b, i, j]; j + 1 <= i so it stays in range
+    induction_mask = F.pad(copying_mask[:, :, :-1], (1, 0), value=False)
+
+    n = lengths.clamp(min=1).double()[:, None]
+    copying = (pattern * copying_mask[:, None]).sum(dim=(-2, -1)) / n
+    induction = (pattern * induction_mask[:, None]).sum(dim=(-2, -1)) / n
+
+    diag = torch.diagonal(pattern, dim1=-2, dim2=-1)  # [B, n_heads, T]
+    diagonal = (diag * valid[:, None]).sum(-1) / n
+
+    # Previous-token attention pattern[i, i - 1] for i = 1 .. length - 1
+    prev = torch.diagonal(pattern, offset=-1, dim1=-2, dim2=-1)  # [B, n_heads, T - 1]
+    prev_valid = valid[:, 1:]
+    prev_count = (lengths - 1).clamp(min=1).double()[:, None]
+    prev_token = torch.where(
+        lengths[:, None] > 1,
+        (prev * prev_valid[:, None]).sum(-1) / prev_count,
+        torch.zeros_like(diagonal),
+    )
+
+    return {
+        "copying_score": copying,
+        "induction_score": induction,
+        "diagonal_score": diagonal,
+        "prev_token_score": prev_token,
+        "copying_mask": copying_mask,
+        "induction_mask": induction_mask,
+    }
+
+
+def attention_entropy(pattern: torch.Tensor, lengths: torch.Tensor = None):
+    """Entropy (nats) of each query row's attention distribution.
+
+    pattern: [B, n_heads, T, T]. Returns [B, n_heads, T]; rows at padded
+    positions (index >= length) are zero.
+    """
+    B, _, T, _ = pattern.shape
+    # entr(p) = -p log p, and 0 where p is 0 (masked positions)
+    entropy = torch.special.entr(pattern.double()).sum(-1)
+    if lengths is not None:
+        valid = torch.arange(T, device=pattern.device)[None, :] < lengths.to(pattern.device)[:, None]
+        entropy = entropy * valid[:, None]
+    return entropy
+
+
+def attention_spectra(pattern: torch.Tensor):
+    """Eigenvalue magnitudes of a batch of attention patterns, sorted descending.
+
+    pattern: [..., T, T]. Causal softmax patterns are lower-triangular, so
+    their eigenvalues are exactly the diagonal entries and no eigensolver is
+    needed; any matrix with weight above the diagonal (e.g. a modified or
+    non-causal pattern) falls back to a batched general eigensolver.
+    """
+    causal = torch.triu(pattern, diagonal=1).abs().amax(dim=(-2, -1)) == 0
+    magnitudes = torch.diagonal(pattern, dim1=-2, dim2=-1).abs()
+    if not causal.all():
+        general = torch.linalg.eigvals(pattern[~causal]).abs().to(magnitudes.dtype)
+        magnitudes = magnitudes.clone()
+        magnitudes[~causal] = general
+    return torch.sort(magnitudes, dim=-1, descending=True).values
+
+
+def first_examples(pattern: torch.Tensor, mask: torch.Tensor, threshold: float = 0.3, limit: int = 5):
+    """Find the first ``limit`` (query, key) pairs per head with attention above threshold.
+
+    pattern: [n_heads, T, T], mask: [T, T] bool restricting which pairs count.
+    Pairs are ordered by query position, then key position. Returns a list
+    of ``[(i, j, attention), ...]`` per head.
+    """
+    n_heads = pattern.shape[0]
+    hits = (pattern > threshold) & mask
+    # Rank hits within each head in row-major order and keep the first few
+    rank = hits.flatten(1).cumsum(dim=1).view_as(hits)
+    heads, rows, cols = torch.nonzero(hits & (rank <= limit), as_tuple=True)
+    values = pattern[heads, rows, cols]
+
+    examples = [[] for _ in range(n_heads)]
+    for h, i, j, a in zip(heads.tolist(), rows.tolist(), cols.tolist(), values.tolist()):
+        examples[h].append((i, j, a))
+    return examples
+
+
+def classify_head_behavior(copying, induction, diagonal, prev_token):
+    """Classify the primary behavior of an attention head"""
+    scores = {
+        "copying": copying,
+        "induction": induction,
+        "diagonal": diagonal,
+        "prev_token": prev_token
+    }
+
+    max_behavior = max(scores, key=scores.get)
+    max_score = scores[max_behavior]
+
+    if max_score < 0.1:
+        return "diffuse"
+    elif max_behavior == "copying":
+        return "copying"
+    elif max_behavior == "induction":
+        return "induction"
+    elif max_behavior == "diagonal":
+        return "self-attention"
+    elif max_behavior == "prev_token":
+        return "previous-token"
+    else:
+        return "mixed"
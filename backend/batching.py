@@ -0,0 +1,137 @@
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+import torch
+
+from model import slice_sequence
+
+
+def split_outputs(outputs, index, length):
+    """Slice one sequence out of a batched capture dict, dropping padding.
+
+    Returns copies with a batch dimension of 1 so the result does not keep
+    the whole batch alive.
+    """
+    return {name: tensor.clone() for name, tensor in slice_sequence(outputs, index, length).items()}
+
+
+class MicroBatcher:
+    """Collects forward passes submitted from concurrent requests into padded batches.
+
+    Requests arriving within ``max_wait_ms`` of the first one are grouped (up
+    to ``max_batch_size`` distinct sequences), right-padded to a common length,
+    run through the model in one call capturing every activation any of them
+    asked for, and split back per request. Because
+    attention is causal and padded keys are masked out, each request gets the
+    same outputs it would have gotten from an unbatched forward pass. Every
+    submission names the model to run, and requests for different models
+    (e.g. checkpoints selected per request) go into separate batches.
+
+    Batches run on the batcher's own thread with ``num_threads`` Torch
+    intra-op threads (default: one per core), independent of the executor's
+    per-worker thread count: the requests waiting on a batch are idle, so the
+    batch gets the whole machine.
+    """
+
+    def __init__(self, max_batch_size: int = 8, max_wait_ms: float = 2.0, pad_id: int = 0,
+                 num_threads: int = None):
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.pad_id = pad_id
+        self.num_threads = num_threads or os.cpu_count() or 1
+        self._queue = queue.Queue()
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self.batches = 0
+        self.sequences = 0
+
+    def run(self, model, ids, capture):
+        """Forward a single sequence of token IDs through ``model``, blocking until its batch completes.
+
+        Returns a dict of the ``capture``d activations with a batch dimension of 1.
+        """
+        if self.max_batch_size <= 1:
+            input_tensor = torch.tensor(ids).unsqueeze(0)
+            with torch.no_grad():
+                return model(input_tensor, capture=capture)
+        return self.submit(model, ids, capture).result()
+
+    def submit(self, model, ids, capture) -> Future:
+        self._ensure_started()
+        future = Future()
+        self._queue.put((model, tuple(ids), frozenset(capture), future))
+        return future
+
+    def stats(self):
+        with self._stats_lock:
+            return {
+                "max_batch_size": self.max_batch_size,
+                "max_wait_ms": self.max_wait * 1000,
+                "num_threads": self.num_threads,
+                "batches": self.batches,
+                "sequences": self.sequences,
+                "mean_batch_size": self.sequences / self.batches if self.batches else 0.0,
+            }
+
+    def _ensure_started(self):
+        with self._start_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._loop, name="micro-batcher", daemon=True)
+                self._thread.start()
+
+    def _loop(self):
+        torch.set_num_threads(self.num_threads)
+        while True:
+            pending = [self._queue.get()]
+            deadline = time.monotonic() + self.max_wait
+            while len(pending) < self.max_batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    pending.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            by_model = {}
+            for model, *request in pending:
+                by_model.setdefault(model, []).append(request)
+            for model, requests in by_model.items():
+                self._run_batch(model, requests)
+
+    def _run_batch(self, model, pending):
+        # Identical prompts submitted together share one row of the batch
+        rows = {}
+        for ids, capture, future in pending:
+            rows.setdefault(ids, []).append((capture, future))
+        sequences = list(rows)
+        capture = frozenset().union(*(c for requests in rows.values() for c, _ in requests))
+
+        try:
+            lengths = [len(ids) for ids in sequences]
+            T = max(lengths)
+            x = torch.full((len(sequences), T), self.pad_id, dtype=torch.long)
+            padding_mask = torch.zeros(len(sequences), T, dtype=torch.bool)
+            for b, ids in enumerate(sequences):
+                x[b, :len(ids)] = torch.tensor(ids, dtype=torch.long)
+                padding_mask[b, :len(ids)] = True
+
+            with torch.no_grad():
+                outputs = model(x, padding_mask=padding_mask, capture=capture)
+
+            for b, ids in enumerate(sequences):
+                result = split_outputs(outputs, b, lengths[b])
+                for requested, future in rows[ids]:
+                    future.set_result({name: result[name] for name in requested})
+        except Exception as e:
+            for requests in rows.values():
+                for _, future in requests:
+                    if not future.done():
+                        future.set_exception(e)
+
+        with self._stats_lock:
+            self.batches += 1
+            self.sequences += len(sequences)
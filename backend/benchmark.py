@@ -0,0 +1,304 @@
+"""Benchmark the model and the API endpoints, and compare runs against a baseline.
+
+Forward passes are timed directly across input lengths and batch sizes.
+Endpoints are called through FastAPI's in-process test client across input
+lengths and concurrency levels. Each scenario reports p50/p95/p99 latency,
+throughput, resident memory (at the end of the scenario, its growth during
+the scenario and the process high-water mark so far) and response size.
+Results are saved as JSON so later runs can be compared against them.
+
+Usage:
+    python benchmark.py run --out baseline.json [--lengths 1,32,128] [--batch-sizes 1,8]
+                            [--concurrency 1,4] [--requests 20] [--endpoints /predict,/attention]
+    python benchmark.py run --out current.json --baseline baseline.json
+    python benchmark.py compare baseline.json current.json [--threshold 1.2]
+
+Every request uses a different prompt unless --warm-cache is given, so by
+default endpoint timings include the forward pass rather than a cache hit.
+The persistent result store is bypassed unless --result-store is given.
+Session updates send unrelated texts, so they time the full-recompute path
+unless --warm-cache is given.
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import resource
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import torch
+
+
+def make_text(enc, n_tokens: int, seed: int):
+    """Random text that encodes to about ``n_tokens`` tokens (decoding and
+    re-encoding may merge a few)"""
+    rng = random.Random(seed)
+    ids = [rng.randrange(256, enc.n_vocab - 1) for _ in range(n_tokens)]
+    return enc.decode(enc.encode(enc.decode(ids))[:n_tokens])
+
+
+# Endpoint scenarios: name -> (uses input length, function building the
+# request as (method, path, keyword arguments for the test client)). A
+# "{session_id}" in the path is filled in with a session created for the scenario.
+ENDPOINTS = {
+    "/predict": (True, lambda text: ("post", "/predict", {"json": {"text": text, "top_k": 10}})),
+    "/predict?precision=int8": (True, lambda text: ("post", "/predict", {"json": {"text": text, "precision": "int8"}})),
+    "/attention": (True, lambda text: ("post", "/attention", {"json": {"text": text}})),
+    "/attention?row_top_k=8": (True, lambda text: ("post", "/attention", {"json": {"text": text, "row_top_k": 8}})),
+    "/activations": (True, lambda text: ("post", "/activations", {"json": {"text": text}})),
+    "/token-predictions": (True, lambda text: ("post", "/token-predictions", {"json": {"text": text, "top_k": 10}})),
+    "/eigenvalues": (True, lambda text: ("post", "/eigenvalues", {"json": {"text": text}})),
+    "/induction-score": (True, lambda text: ("post", "/induction-score", {"json": {"text": text}})),
+    "/logit-lens": (True, lambda text: ("post", "/logit-lens", {"json": {"text": text, "top_k": 5}})),
+    "/analyze": (True, lambda text: ("post", "/analyze", {"json": {"text": text}})),
+    "/precision-report": (True, lambda text: ("post", "/precision-report", {"json": {"text": text, "repeats": 1}})),
+    "/sessions/{id}/update": (True, lambda text: ("post", "/sessions/{session_id}/update", {"json": {"text": text}})),
+    "/capture": (True, lambda text: ("post", "/capture", {"json": {"text": text, "names": ["pattern"]}})),
+    "/induction-score/repeated": (False, lambda text: ("post", "/induction-score/repeated", {"json": {"n_prompts": 64, "length": 32}})),
+    "/analyze-long": (True, lambda text: ("post", "/analyze-long", {"json": {"text": text * 4, "stream": False}})),
+    "/embeddings": (False, lambda text: ("get", "/embeddings", {"params": {"limit": 1000}})),
+    "/embeddings/subset": (False, lambda text: ("post", "/embeddings/subset", {"json": {"token_ids": list(range(1000, 1100))}})),
+    "/weights": (False, lambda text: ("get", "/weights", {})),
+    "/analogy": (False, lambda text: ("post", "/analogy", {"json": {"positive": ["king", "woman"], "negative": ["man"]}})),
+    "/analogy/batch": (False, lambda text: ("post", "/analogy/batch", {"json": {"analogies": [
+        {"positive": [a, b], "negative": [c]}
+        for a, b, c in [("king", "woman", "man"), ("Paris", "Germany", "France"), ("walked", "swim", "walk"),
+                        ("big", "small", "bigger"), ("cat", "puppy", "dog"), ("good", "bad", "better"),
+                        ("sun", "night", "day"), ("boy", "aunt", "girl")]
+    ]}})),
+    "/nearest-tokens": (False, lambda text: ("post", "/nearest-tokens", {"json": {"words": ["cat"], "top_k": 10}})),
+}
+
+
+def peak_rss_mb():
+    """High-water mark of the process's resident memory since it started"""
+    # ru_maxrss is in KiB on Linux and bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def rss_mb():
+    """Current resident memory, or None where /proc is not available"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+    except (OSError, ValueError):
+        return None
+
+
+def summarize(latencies, wall_seconds, rss_before=None, **extra):
+    latencies = np.array(latencies) * 1000
+    return {
+        **extra,
+        "n": len(latencies),
+        "mean_ms": float(latencies.mean()),
+        "p50_ms": float(np.percentile(latencies, 50)),
+        "p95_ms": float(np.percentile(latencies, 95)),
+        "p99_ms": float(np.percentile(latencies, 99)),
+        "throughput_per_second": len(latencies) / wall_seconds,
+        **memory_stats(rss_before),
+    }
+
+
+def memory_stats(rss_before):
+    rss = rss_mb()
+    return {
+        "rss_mb": rss,
+        "rss_growth_mb": rss - rss_before if rss is not None and rss_before is not None else None,
+        "process_peak_rss_mb": peak_rss_mb(),
+    }
+
+
+def bench_forward(model, length: int, batch_size: int, repeats: int):
+    x = torch.randint(0, model.vocab_size, (batch_size, length))
+    rss_before = rss_mb()
+    latencies = []
+    with torch.no_grad():
+        model(x)  # warm up
+        start = time.perf_counter()
+        for _ in range(repeats):
+            t = time.perf_counter()
+            model(x)
+            latencies.append(time.perf_counter() - t)
+    wall = time.perf_counter() - start
+    result = summarize(latencies, wall, rss_before, kind="forward", name="forward", length=length, batch_size=batch_size, concurrency=1)
+    result["tokens_per_second"] = result["throughput_per_second"] * batch_size * length
+    return result
+
+
+def bench_endpoint(client, enc, name, length, concurrency: int, requests: int, warm_cache: bool, seed: int):
+    uses_length, build = ENDPOINTS[name]
+    # One session per concurrent client, so updates do not queue on a session's lock
+    sessions = [client.post("/sessions").json()["session_id"] for _ in range(concurrency)] \
+        if "{session_id}" in build("")[1] else []
+
+    def call(i):
+        text = make_text(enc, length, seed if warm_cache else seed + i) if uses_length else None
+        method, path, kwargs = build(text)
+        if sessions:
+            path = path.format(session_id=sessions[i % concurrency])
+        t = time.perf_counter()
+        response = getattr(client, method)(path, **kwargs)
+        return time.perf_counter() - t, response.status_code, len(response.content)
+
+    call(-1)  # warm up (weight analyses, precision variants, ...)
+    rss_before = rss_mb()
+    start = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as pool:
+        results = list(pool.map(call, range(requests)))
+    wall = time.perf_counter() - start
+
+    ok = [r for r in results if r[1] == 200]
+    latencies = [r[0] for r in ok] or [float("nan")]
+    for session_id in sessions:
+        client.delete(f"/sessions/{session_id}")
+    result = summarize(latencies, wall, rss_before, kind="endpoint", name=name, length=length if uses_length else None,
+                       batch_size=1, concurrency=concurrency)
+    result["errors"] = len(results) - len(ok)
+    result["payload_bytes"] = int(np.mean([r[2] for r in ok])) if ok else None
+    return result
+
+
+def scenario_key(result):
+    return f"{result['kind']} {result['name']} length={result['length']} batch={result['batch_size']} concurrency={result['concurrency']}"
+
+
+def compare(baseline, current, threshold: float = 1.2):
+    """Scenarios whose p50 or p95 latency grew by more than ``threshold`` times"""
+    base = {scenario_key(r): r for r in baseline["results"]}
+    rows, regressions = [], []
+    for result in current["results"]:
+        key = scenario_key(result)
+        before = base.get(key)
+        if before is None:
+            continue
+        row = {"scenario": key}
+        for metric in ("p50_ms", "p95_ms"):
+            row[metric] = (before[metric], result[metric], result[metric] / before[metric] if before[metric] else None)
+        rows.append(row)
+        if any(ratio is not None and ratio > threshold for _, _, ratio in (row["p50_ms"], row["p95_ms"])):
+            regressions.append(key)
+    return rows, regressions
+
+
+def print_comparison(rows, regressions, threshold):
+    for row in rows:
+        p50, p95 = row["p50_ms"], row["p95_ms"]
+        flag = "  REGRESSION" if row["scenario"] in regressions else ""
+        print(f"{row['scenario']}: p50 {p50[0]:.2f} -> {p50[1]:.2f} ms ({p50[2]:.2f}x), "
+              f"p95 {p95[0]:.2f} -> {p95[1]:.2f} ms ({p95[2]:.2f}x){flag}")
+    print(f"{len(regressions)} of {len(rows)} scenarios slower than {threshold}x the baseline")
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def run(args):
+    from fastapi.testclient import TestClient
+    import main
+
+    main.load_runtime()
+    if not args.result_store:
+        # Results persisted by an earlier run would turn repeat prompts into disk reads
+        main.result_store = None
+    model, enc = main.model, main.enc
+    client = TestClient(main.app)
+    lengths = [min(n, model.context_len) for n in args.lengths]
+    endpoints = args.endpoints or list(ENDPOINTS)
+    unknown = [name for name in endpoints if name not in ENDPOINTS]
+    if unknown:
+        raise SystemExit(f"Unknown endpoints: {', '.join(unknown)}. Available: {', '.join(ENDPOINTS)}")
+
+    results = []
+    for length in lengths:
+        for batch_size in args.batch_sizes:
+            results.append(bench_forward(model, length, batch_size, args.requests))
+            print(scenario_key(results[-1]), f"p50 {results[-1]['p50_ms']:.2f} ms")
+
+    for name in endpoints:
+        for length in (lengths if ENDPOINTS[name][0] else [None]):
+            for concurrency in args.concurrency:
+                if not args.warm_cache:
+                    main.forward_cache.clear()
+                result = bench_endpoint(client, enc, name, length, concurrency, args.requests, args.warm_cache, args.seed)
+                results.append(result)
+                print(scenario_key(result), f"p50 {result['p50_ms']:.2f} ms, {result['payload_bytes']} bytes, "
+                      f"{result['errors']} errors")
+
+    report = {
+        "meta": {
+            "timestamp": time.time(),
+            "git_commit": git_commit(),
+            "model_version": model.version,
+            "python": platform.python_version(),
+            "torch": torch.__version__,
+            "cpu_count": os.cpu_count(),
+            "warm_cache": args.warm_cache,
+            "result_store": args.result_store,
+        },
+        "results": results,
+    }
+    with open(args.out, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Wrote {len(results)} scenarios to {args.out}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            rows, regressions = compare(json.load(f), report, args.threshold)
+        print_comparison(rows, regressions, args.threshold)
+        if regressions:
+            raise SystemExit(1)
+
+
+def int_list(value):
+    return [int(v) for v in value.split(",") if v]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the model and API endpoints")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = commands.add_parser("run", help="Run the benchmarks and save the results")
+    run_parser.add_argument("--out", required=True, help="JSON file to write results to")
+    run_parser.add_argument("--lengths", type=int_list, default=[1, 16, 64, 128], help="Input lengths in tokens")
+    run_parser.add_argument("--batch-sizes", type=int_list, default=[1, 8], help="Batch sizes for forward passes")
+    run_parser.add_argument("--concurrency", type=int_list, default=[1, 4], help="Concurrent clients per endpoint")
+    run_parser.add_argument("--requests", type=int, default=20, help="Timed calls per scenario")
+    run_parser.add_argument("--endpoints", type=lambda v: v.split(","), default=None, help="Comma-separated subset of endpoints")
+    run_parser.add_argument("--warm-cache", action="store_true", help="Repeat one prompt per scenario instead of a new one per request")
+    run_parser.add_argument("--result-store", action="store_true", help="Serve repeat prompts from the persistent result store")
+    run_parser.add_argument("--seed", type=int, default=0)
+    run_parser.add_argument("--baseline", help="Compare against this earlier result file")
+    run_parser.add_argument("--threshold", type=float, default=1.2, help="Slowdown ratio counted as a regression")
+
+    compare_parser = commands.add_parser("compare", help="Compare two result files")
+    compare_parser.add_argument("baseline")
+    compare_parser.add_argument("current")
+    compare_parser.add_argument("--threshold", type=float, default=1.2)
+
+    args = parser.parse_args()
+    if args.command == "run":
+        run(args)
+    else:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        with open(args.current) as f:
+            current = json.load(f)
+        rows, regressions = compare(baseline, current, args.threshold)
+        print_comparison(rows, regressions, args.threshold)
+        if regressions:
+            raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
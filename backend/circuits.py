@@ -0,0 +1,75 @@
+import threading
+
+import torch
+
+from model import artifact_path, load_or_compute_artifact
+
+# In-memory spectra per checkpoint hash, filled from disk or computed once
+_spectra = {}
+_lock = threading.Lock()
+
+
+def _low_rank_svd(left: torch.Tensor, right: torch.Tensor):
+    """Batched SVD of ``left @ right.T`` without forming the product.
+
+    left, right: [n_heads, d_model, d_head]. The product is [d_model, d_model]
+    but has rank at most d_head, so QR-factorizing both sides reduces the SVD
+    to a [d_head, d_head] matrix per head: left @ right.T = Q_l (R_l R_r^T) Q_r^T.
+    Returns U [n_heads, d_model, d_head], S [n_heads, d_head] and
+    V [n_heads, d_model, d_head] with left @ right.T = U diag(S) V^T.
+    """
+    Q_l, R_l = torch.linalg.qr(left)
+    Q_r, R_r = torch.linalg.qr(right)
+    U_small, S, Vh_small = torch.linalg.svd(R_l @ R_r.transpose(-2, -1))
+    return Q_l @ U_small, S, Q_r @ Vh_small.transpose(-2, -1)
+
+
+def compute_circuit_spectra(model):
+    """Singular value spectra and low-rank factors of every head's OV and QK circuits.
+
+    OV circuit of head h: W_O[h] @ W_V[h]   (d_model -> d_model)
+    QK circuit of head h: W_Q[h]^T @ W_K[h] (bilinear form on d_model)
+    """
+    n_heads, d_head, d_model = model.n_heads, model.d_head, model.d_model
+    with torch.no_grad():
+        # Linear weights are stored (out, in); per-head slices are [d_head, d_model]
+        W_Q = model.W_Q.weight.detach().float().view(n_heads, d_head, d_model)
+        W_K = model.W_K.weight.detach().float().view(n_heads, d_head, d_model)
+        W_V = model.W_V.weight.detach().float().view(n_heads, d_head, d_model)
+        W_O = model.W_O.weight.detach().float().view(d_model, n_heads, d_head).permute(1, 0, 2)  # [n_heads, d_model, d_head]
+
+        ov_U, ov_S, ov_V = _low_rank_svd(W_O, W_V.transpose(-2, -1))
+        qk_U, qk_S, qk_V = _low_rank_svd(W_Q.transpose(-2, -1), W_K.transpose(-2, -1))
+
+    return {
+        "ov_singular_values": ov_S,
+        "qk_singular_values": qk_S,
+        "ov_U": ov_U,
+        "ov_V": ov_V,
+        "qk_U": qk_U,
+        "qk_V": qk_V,
+    }
+
+
+def get_circuit_spectra(model):
+    """Circuit spectra for the model's checkpoint, computed at most once.
+
+    Results are kept in memory and persisted next to the checkpoint file,
+    keyed by the checkpoint hash, so restarts only pay a disk read.
+    """
+    with _lock:
+        spectra = _spectra.get(model.version)
+        if spectra is not None:
+            return spectra
+
+        spectra = load_or_compute_artifact(
+            artifact_path(model, "circuits"), lambda: compute_circuit_spectra(model), "circuit spectra"
+        )
+        _spectra[model.version] = spectra
+        return spectra
+
+
+def forget_spectra(version):
+    """Drop the in-memory spectra of checkpoint ``version`` (the file on disk stays)"""
+    with _lock:
+        _spectra.pop(version, None)
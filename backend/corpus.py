@@ -0,0 +1,281 @@
+"""Corpus-level analysis: run the model over a whole text file in batched
+context-length windows and aggregate per-head statistics and per-token loss.
+
+Results are written incrementally to a directory of raw little-endian
+columns described by ``manifest.json`` (see ``ColumnWriter``), so partial
+results can be read with ``read_column`` while a job is still running.
+
+Usage:
+    python corpus.py corpus.txt --out results/ [--batch-size 16] [--max-tokens N]
+"""
+import argparse
+import json
+import os
+import threading
+import time
+
+import numpy as np
+import torch
+import torch.nn.functional as F
+
+from analysis import head_behavior_scores, attention_entropy, classify_head_behavior
+
+HEAD_STATS = ("copying_score", "induction_score", "diagonal_score", "prev_token_score", "attention_entropy")
+
+
+def iter_corpus_tokens(path, enc, chunk_chars: int = 1 << 20):
+    """Tokenize a text file chunk by chunk without loading it all into memory.
+
+    Chunks are cut after the last newline (or space) so tokens are not split
+    across chunk boundaries.
+    """
+    carry = ""
+    with open(path, encoding="utf-8", errors="replace") as f:
+        while True:
+            chunk = f.read(chunk_chars)
+            if not chunk:
+                break
+            text = carry + chunk
+            cut = max(text.rfind("\n"), text.rfind(" "))
+            if cut <= 0:
+                carry = text
+                continue
+            carry = text[cut:]
+            yield enc.encode(text[:cut])
+    if carry:
+        yield enc.encode(carry)
+
+
+def limit_tokens(token_chunks, max_tokens: int = None):
+    """Truncate a stream of token chunks after ``max_tokens`` tokens"""
+    remaining = max_tokens
+    for chunk in token_chunks:
+        if remaining is not None:
+            chunk = chunk[:remaining]
+            remaining -= len(chunk)
+        if chunk:
+            yield chunk
+        if remaining == 0:
+            break
+
+
+def iter_corpus_windows(token_chunks, context_len: int):
+    """Group a stream of token chunks into context-length windows.
+
+    Consecutive windows overlap by one token so the last position of each
+    window has a next-token target: every token after the first is predicted
+    exactly once. The final window may be shorter.
+    """
+    buffer = []
+    for chunk in token_chunks:
+        buffer.extend(chunk)
+        while len(buffer) >= context_len:
+            yield buffer[:context_len]
+            buffer = buffer[context_len - 1:]
+    if len(buffer) > 1:
+        yield buffer
+
+
+class ColumnWriter:
+    """Append-only columnar output: one raw ``<name>.bin`` file per column.
+
+    ``manifest.json`` records each column's dtype, per-row shape and row
+    count, and is rewritten after every flush so readers only see complete rows.
+    """
+
+    def __init__(self, out_dir, metadata=None):
+        self.out_dir = out_dir
+        os.makedirs(out_dir, exist_ok=True)
+        self.columns = {}
+        self.metadata = metadata or {}
+
+    def append(self, name, rows: np.ndarray):
+        rows = np.ascontiguousarray(rows)
+        rows = rows.astype(rows.dtype.newbyteorder("<"), copy=False)
+        column = self.columns.get(name)
+        if column is None:
+            column = {"dtype": rows.dtype.str, "shape": list(rows.shape[1:]), "rows": 0}
+            self.columns[name] = column
+            open(os.path.join(self.out_dir, f"{name}.bin"), "wb").close()
+        with open(os.path.join(self.out_dir, f"{name}.bin"), "ab") as f:
+            f.write(rows.tobytes())
+        column["rows"] += rows.shape[0]
+
+    def flush(self, **extra):
+        manifest = {"columns": self.columns, **self.metadata, **extra}
+        tmp = os.path.join(self.out_dir, "manifest.json.tmp")
+        with open(tmp, "w") as f:
+            json.dump(manifest, f, indent=2)
+        os.replace(tmp, os.path.join(self.out_dir, "manifest.json"))
+
+
+def read_column(out_dir, name):
+    """Memory-map a column written by ``ColumnWriter`` (rows listed in the manifest only)"""
+    with open(os.path.join(out_dir, "manifest.json")) as f:
+        column = json.load(f)["columns"][name]
+    shape = (column["rows"], *column["shape"])
+    if column["rows"] == 0:
+        return np.zeros(shape, dtype=column["dtype"])
+    return np.memmap(os.path.join(out_dir, f"{name}.bin"), dtype=column["dtype"], mode="r", shape=shape)
+
+
+class CorpusJob:
+    """Analyze a corpus file, writing columns incrementally and tracking running aggregates.
+
+    Columns:
+        tokens            int32   [n_tokens]          every token of the corpus
+        loss              float32 [n_tokens]          next-token loss predicting that token (NaN for the first)
+        window_<stat>     float32 [n_windows, n_heads] per-window head statistics
+    """
+
+    def __init__(self, model, enc, path, out_dir, batch_size: int = 16, max_tokens: int = None):
+        self.model = model
+        self.enc = enc
+        self.path = path
+        self.out_dir = out_dir
+        self.batch_size = batch_size
+        self.max_tokens = max_tokens
+
+        self.status = "pending"
+        self.error = None
+        self.tokens_processed = 0
+        self.windows_processed = 0
+        self.started_at = None
+        self.finished_at = None
+        self._cancel = threading.Event()
+
+        self._loss_sum = 0.0
+        self._loss_count = 0
+        self._head_sums = {name: torch.zeros(model.n_heads, dtype=torch.float64) for name in HEAD_STATS}
+        self._head_weight = 0
+
+    def cancel(self):
+        self._cancel.set()
+
+    def run(self):
+        self.status = "running"
+        self.started_at = time.time()
+        writer = ColumnWriter(self.out_dir, metadata={
+            "source": os.path.abspath(self.path),
+            "model_version": self.model.version,
+            "context_len": self.model.context_len,
+            "n_heads": self.model.n_heads,
+        })
+        try:
+            tokens = limit_tokens(iter_corpus_tokens(self.path, self.enc), self.max_tokens)
+            batch = []
+            for window in iter_corpus_windows(tokens, self.model.context_len):
+                if self._cancel.is_set():
+                    break
+                batch.append(window)
+                if len(batch) == self.batch_size:
+                    self._process_batch(batch, writer)
+                    batch = []
+            if batch and not self._cancel.is_set():
+                self._process_batch(batch, writer)
+            self.status = "cancelled" if self._cancel.is_set() else "done"
+        except Exception as e:
+            self.status = "error"
+            self.error = str(e)
+        self.finished_at = time.time()
+        writer.flush(status=self.status, summary=self.summary())
+
+    def _process_batch(self, windows, writer):
+        B = len(windows)
+        lengths = torch.tensor([len(w) for w in windows])
+        T = int(lengths.max())
+        x = torch.zeros(B, T, dtype=torch.long)
+        for b, w in enumerate(windows):
+            x[b, :len(w)] = torch.tensor(w)
+        valid = torch.arange(T)[None, :] < lengths[:, None]
+
+        with torch.no_grad():
+            outputs = self.model(x, padding_mask=valid, capture=("logits", "pattern"))
+            logits, pattern = outputs["logits"], outputs["pattern"]
+            # Loss of predicting token t + 1 from position t
+            log_probs = F.log_softmax(logits[:, :-1].float(), dim=-1)
+            loss = -log_probs.gather(-1, x[:, 1:, None]).squeeze(-1)  # [B, T - 1]
+
+        scores = head_behavior_scores(pattern, x, lengths)
+        entropy = attention_entropy(pattern, lengths).sum(-1) / lengths[:, None]  # [B, n_heads]
+        stats = {name: scores[name] for name in HEAD_STATS[:-1]}
+        stats["attention_entropy"] = entropy
+
+        # The first window contributes its first token (no loss); later windows
+        # start with the previous window's last token, which is skipped
+        for b, w in enumerate(windows):
+            n = len(w)
+            if self.tokens_processed == 0:
+                writer.append("tokens", np.array(w[:1], dtype=np.int32))
+                writer.append("loss", np.array([np.nan], dtype=np.float32))
+                self.tokens_processed = 1
+            writer.append("tokens", np.array(w[1:], dtype=np.int32))
+            writer.append("loss", loss[b, :n - 1].numpy().astype(np.float32))
+            self.tokens_processed += n - 1
+            self._loss_sum += loss[b, :n - 1].double().sum().item()
+            self._loss_count += n - 1
+
+        for name, values in stats.items():
+            writer.append(f"window_{name}", values.float().numpy())
+            self._head_sums[name] += (values.double() * lengths[:, None]).sum(0)
+        self._head_weight += int(lengths.sum())
+        self.windows_processed += B
+        writer.flush(status="running", summary=self.summary())
+
+    def summary(self):
+        """Running aggregates: mean loss and token-weighted per-head statistics"""
+        mean_loss = self._loss_sum / self._loss_count if self._loss_count else None
+        heads = []
+        if self._head_weight:
+            for h in range(self.model.n_heads):
+                stats = {name: (self._head_sums[name][h] / self._head_weight).item() for name in HEAD_STATS}
+                stats["head"] = h
+                stats["behavior_type"] = classify_head_behavior(
+                    stats["copying_score"], stats["induction_score"], stats["diagonal_score"], stats["prev_token_score"]
+                )
+                heads.append(stats)
+        return {
+            "tokens": self.tokens_processed,
+            "windows": self.windows_processed,
+            "mean_loss": mean_loss,
+            "heads": heads,
+        }
+
+    def info(self):
+        elapsed = ((self.finished_at or time.time()) - self.started_at) if self.started_at else 0.0
+        return {
+            "status": self.status,
+            "error": self.error,
+            "out_dir": self.out_dir,
+            "elapsed_seconds": elapsed,
+            "tokens_per_second": self.tokens_processed / elapsed if elapsed else 0.0,
+            "summary": self.summary(),
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run corpus-level head analysis")
+    parser.add_argument("corpus", help="UTF-8 text file to analyze")
+    parser.add_argument("--out", required=True, help="Output directory for columns and manifest")
+    parser.add_argument("--batch-size", type=int, default=16)
+    parser.add_argument("--max-tokens", type=int, default=None)
+    args = parser.parse_args()
+
+    from model import load_model
+    model, enc = load_model()
+    job = CorpusJob(model, enc, args.corpus, args.out, batch_size=args.batch_size, max_tokens=args.max_tokens)
+
+    thread = threading.Thread(target=job.run, daemon=True)
+    thread.start()
+    while thread.is_alive():
+        thread.join(timeout=5)
+        info = job.info()
+        print(f"{info['status']}: {info['summary']['tokens']} tokens, "
+              f"{info['tokens_per_second']:.0f} tokens/s, mean loss {info['summary']['mean_loss']}")
+    if job.status == "error":
+        raise SystemExit(f"Corpus job failed: {job.error}")
+    print(json.dumps(job.summary(), indent=2))
+
+
+if __name__ == "__main__":
+    main()
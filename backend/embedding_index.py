@@ -0,0 +1,120 @@
+import threading
+
+import torch
+import torch.nn.functional as F
+
+from model import artifact_path, load_or_compute_artifact
+
+# Weight matrices that can be searched, as [vocab_size, d_model] rows
+SPACES = {
+    "embed": lambda model: model.W_E.weight,
+    "unembed": lambda model: model.W_U.weight,
+}
+
+_indexes = {}
+_lock = threading.Lock()
+
+
+class EmbeddingIndex:
+    """Cosine-similarity search over the rows of a token matrix.
+
+    Rows are normalized once at construction. ``mode="exact"`` scores every
+    row with one matmul for the whole batch of queries; ``mode="approx"``
+    uses an inverted-file (IVF) index: rows are clustered with spherical
+    k-means and each query only scores the rows in its ``nprobe`` closest
+    clusters.
+    """
+
+    def __init__(self, vectors: torch.Tensor, ivf_path: str = None):
+        self.normalized = F.normalize(vectors.detach().float(), dim=1)
+        self.ivf_path = ivf_path
+        self.ivf = None
+        self._ivf_lock = threading.Lock()
+
+    def search(self, queries: torch.Tensor, k: int, mode: str = "exact", nprobe: int = 8):
+        """Top-k most similar rows for each query.
+
+        queries: [Q, d_model] (need not be normalized)
+        Returns (scores [Q, k], ids [Q, k]).
+        """
+        queries = F.normalize(queries.float(), dim=1)
+        k = min(k, self.normalized.shape[0])
+        if mode == "exact":
+            return torch.topk(queries @ self.normalized.T, k, dim=-1)
+        if mode == "approx":
+            return self._search_ivf(queries, k, nprobe)
+        raise ValueError(f"Unknown search mode: {mode}")
+
+    def _search_ivf(self, queries, k, nprobe):
+        centroids, order, offsets = self.get_ivf()
+        nprobe = min(nprobe, centroids.shape[0])
+        probe = torch.topk(queries @ centroids.T, nprobe, dim=-1).indices  # [Q, nprobe]
+
+        all_scores, all_ids = [], []
+        for q in range(queries.shape[0]):
+            candidates = torch.cat([order[offsets[c]:offsets[c + 1]] for c in probe[q].tolist()])
+            sims = self.normalized[candidates] @ queries[q]
+            top = torch.topk(sims, min(k, sims.shape[0]))
+            scores = torch.full((k,), float("-inf"))
+            ids = torch.full((k,), -1, dtype=torch.long)
+            scores[:top.values.shape[0]] = top.values
+            ids[:top.indices.shape[0]] = candidates[top.indices]
+            all_scores.append(scores)
+            all_ids.append(ids)
+        return torch.stack(all_scores), torch.stack(all_ids)
+
+    def get_ivf(self):
+        """(centroids, order, offsets) of the IVF index, loaded or built on first use.
+
+        Rows of cluster c are ``order[offsets[c]:offsets[c + 1]]``.
+        """
+        with self._ivf_lock:
+            if self.ivf is None:
+                saved = load_or_compute_artifact(
+                    self.ivf_path, lambda: dict(zip(("centroids", "order", "offsets"), self.build_ivf())), "IVF index"
+                )
+                self.ivf = (saved["centroids"], saved["order"], saved["offsets"])
+            return self.ivf
+
+    def build_ivf(self, n_lists: int = None, iterations: int = 10, seed: int = 0):
+        """Cluster the normalized rows with spherical k-means"""
+        vectors = self.normalized
+        n = vectors.shape[0]
+        if n_lists is None:
+            n_lists = max(1, int(n ** 0.5))
+        generator = torch.Generator().manual_seed(seed)
+        centroids = vectors[torch.randperm(n, generator=generator)[:n_lists]].clone()
+
+        for _ in range(iterations):
+            assignment = (vectors @ centroids.T).argmax(dim=1)
+            sums = torch.zeros_like(centroids).index_add_(0, assignment, vectors)
+            counts = torch.bincount(assignment, minlength=n_lists)
+            # Empty clusters keep their previous centroid
+            centroids = torch.where(counts[:, None] > 0, F.normalize(sums, dim=1), centroids)
+
+        assignment = (vectors @ centroids.T).argmax(dim=1)
+        order = torch.argsort(assignment, stable=True)
+        counts = torch.bincount(assignment, minlength=n_lists)
+        offsets = torch.zeros(n_lists + 1, dtype=torch.long)
+        offsets[1:] = torch.cumsum(counts, dim=0)
+        return centroids, order, offsets
+
+
+def get_index(model, space: str = "embed") -> EmbeddingIndex:
+    """Index over the model's embedding or unembedding rows, built once per checkpoint"""
+    if space not in SPACES:
+        raise ValueError(f"Unknown space: {space}")
+    key = (model.version, space)
+    with _lock:
+        index = _indexes.get(key)
+        if index is None:
+            index = EmbeddingIndex(SPACES[space](model), artifact_path(model, f"ivf-{space}"))
+            _indexes[key] = index
+        return index
+
+
+def forget_indexes(version):
+    """Drop the indexes over checkpoint ``version``"""
+    with _lock:
+        for key in [key for key in _indexes if key[0] == version]:
+            del _indexes[key]
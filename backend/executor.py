@@ -0,0 +1,149 @@
+import asyncio
+import contextvars
+import functools
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import torch
+
+
+_END = object()
+
+
+class Overloaded(Exception):
+    """Raised when the inference queue is full; handlers map it to 503"""
+
+
+class InferenceExecutor:
+    """Dedicated worker threads for Torch inference, called from async handlers.
+
+    ``workers`` requests run concurrently, each using ``threads_per_worker``
+    intra-op threads, so the total stays near the core count instead of every
+    request fanning out across all cores. Each worker sets its thread count
+    when it starts; forward passes handed to the micro-batcher run on its
+    thread with its own count (see ``batching.MicroBatcher``). At most ``max_queue`` further
+    requests wait for a worker; beyond that ``run`` raises ``Overloaded``
+    immediately. ``timeout`` bounds how long a caller waits (a computation
+    that has already started still runs to completion and holds its slot).
+    """
+
+    def __init__(self, workers: int = 4, threads_per_worker: int = None, max_queue: int = 64, timeout: float = 30.0):
+        self.workers = workers
+        self.threads_per_worker = threads_per_worker or max(1, (os.cpu_count() or 1) // workers)
+        self.max_queue = max_queue
+        self.timeout = timeout
+        self._pool = ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix="inference", initializer=self._init_worker
+        )
+        self._slots = threading.BoundedSemaphore(workers + max_queue)
+        self._stats_lock = threading.Lock()
+        self.in_flight = 0
+        self.completed = 0
+        self.rejected = 0
+        self.timeouts = 0
+
+    def _init_worker(self):
+        torch.set_num_threads(self.threads_per_worker)
+
+    def _acquire(self):
+        if not self._slots.acquire(blocking=False):
+            with self._stats_lock:
+                self.rejected += 1
+            raise Overloaded()
+        with self._stats_lock:
+            self.in_flight += 1
+
+    async def run(self, fn, *args, **kwargs):
+        """Run ``fn(*args, **kwargs)`` on a worker and await its result"""
+        self._acquire()
+        # Keep context variables (e.g. per-request instrumentation) in the worker
+        context = contextvars.copy_context()
+        future = self._pool.submit(context.run, functools.partial(fn, *args, **kwargs))
+        future.add_done_callback(self._release)
+        try:
+            return await asyncio.wait_for(asyncio.wrap_future(future), self.timeout)
+        except asyncio.TimeoutError:
+            with self._stats_lock:
+                self.timeouts += 1
+            raise
+
+    def stream(self, items):
+        """Async iterator over the blocking iterator ``items``, advanced one item
+        at a time on a worker.
+
+        The stream takes its slot immediately (raising ``Overloaded`` if there
+        is none) and holds it until it is exhausted, fails or is closed, so a
+        long stream counts as one request. ``timeout`` applies to each item.
+        """
+        self._acquire()
+        return WorkerStream(self, items, contextvars.copy_context())
+
+    def _release(self, future):
+        with self._stats_lock:
+            self.in_flight -= 1
+            self.completed += 1
+        self._slots.release()
+
+    def stats(self):
+        with self._stats_lock:
+            return {
+                "workers": self.workers,
+                "threads_per_worker": self.threads_per_worker,
+                "max_queue": self.max_queue,
+                "timeout_seconds": self.timeout,
+                "in_flight": self.in_flight,
+                "queued": max(0, self.in_flight - self.workers),
+                "completed": self.completed,
+                "rejected": self.rejected,
+                "timeouts": self.timeouts,
+            }
+
+
+class WorkerStream:
+    """Iterator returned by ``InferenceExecutor.stream``"""
+
+    def __init__(self, executor, items, context):
+        self.executor = executor
+        self.items = items
+        self.context = context
+        self._future = None
+        self._closed = False
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if self._closed:
+            raise StopAsyncIteration
+        self._future = self.executor._pool.submit(self.context.run, next, self.items, _END)
+        try:
+            item = await asyncio.wait_for(asyncio.wrap_future(self._future), self.executor.timeout)
+        except asyncio.TimeoutError:
+            with self.executor._stats_lock:
+                self.executor.timeouts += 1
+            self.close()
+            raise
+        except BaseException:
+            self.close()
+            raise
+        if item is _END:
+            self.close()
+            raise StopAsyncIteration
+        return item
+
+    async def aclose(self):
+        self.close()
+
+    def close(self):
+        """Give the slot back; an item still being computed keeps it until it finishes"""
+        if self._closed:
+            return
+        self._closed = True
+        if self._future is not None and not self._future.done():
+            self._future.add_done_callback(self.executor._release)
+        else:
+            self.executor._release(self._future)
+
+    # A response that is never sent must not leak the slot
+    __del__ = close
@@ -1,10 +1,46 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Query, Request, Response
+from fastapi.responses import StreamingResponse, JSONResponse, FileResponse
 from fastapi.middleware.cors import CORSMiddleware
+from starlette.background import BackgroundTask
 from pydantic import BaseModel
+from typing import Optional
 import torch
 import torch.nn.functional as F
-from model import load_model
-import numpy as np
+from model import CAPTURES, load_model
+from cache import ForwardCache
+from batching import MicroBatcher
+from executor import InferenceExecutor, Overloaded
+from circuits import get_circuit_spectra, forget_spectra
+from embedding_index import SPACES, get_index, forget_indexes
+from projections import get_vocab_projection, get_subset_projection, forget_projections
+from precision import PRECISIONS, get_variant, accuracy_report, forget_variants
+from analysis import (
+    head_behavior_scores, attention_entropy, attention_spectra, first_examples, classify_head_behavior
+)
+from windows import iter_windows
+from corpus import CorpusJob
+from sessions import SessionStore
+from registry import ModelRegistry
+from sweeps import repeated_random_sequences, summarize_scores, sweep_scores
+from result_store import DEFAULT_PATH as RESULT_STORE_DEFAULT_PATH, ResultStore, result_key
+from metrics import (
+    Metrics, start_request, end_request, current as current_request, stage, record_tensors, profiling, server_timing
+)
+from views import POOL_MODES, position_range, head_subset, pool_last_dims, encode_view
+from tensor_format import MEDIA_TYPE, negotiate, encode_payload, to_json_compatible
+import os
+import json
+import math
+import threading
+import time
+import uuid
+import asyncio
+import contextvars
+import functools
+import random
+import sqlite3
+import tempfile
+from contextlib import contextmanager
 
 app = FastAPI()
 
@@ -21,125 +57,712 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Load model on startup
-model, enc = load_model()
+# The model, tokenizer and token table are loaded in the background once the
+# server starts (see load_runtime), so the process accepts connections
+# immediately and /ready reports when it can serve requests
+model = None
+enc = None
+# Token ID -> string table, so responses never call enc.decode per token
+token_strings = None
+model_ready = threading.Event()
+# With several worker processes (uvicorn --workers N), point this at e.g.
+# /dev/shm/attention-lens so they all map one copy of the weights
+SHARED_WEIGHTS_DIR = os.environ.get("ATTENTION_LENS_SHARED_WEIGHTS") or None
+load_state = {"status": "pending", "error": None, "seconds": None}
+
+# Forward-pass outputs shared by all text endpoints, so analyzing one prompt
+# across several tabs only runs the model once
+forward_cache = ForwardCache(
+    max_bytes=int(os.environ.get("ATTENTION_LENS_CACHE_MB", "512")) * 1024 * 1024,
+    ttl=float(os.environ.get("ATTENTION_LENS_CACHE_TTL", "600")),
+)
+
+# Analysis results persisted across restarts and shared by worker processes
+# (see result_store.py). Set ATTENTION_LENS_RESULT_STORE=off to disable.
+RESULT_STORE_PATH = os.environ.get("ATTENTION_LENS_RESULT_STORE", RESULT_STORE_DEFAULT_PATH)
+result_store = None if RESULT_STORE_PATH in ("", "off") else ResultStore(
+    RESULT_STORE_PATH,
+    max_bytes=int(os.environ.get("ATTENTION_LENS_RESULT_STORE_MB", "1024")) * 1024 * 1024,
+)
+
+# Forward passes that miss the cache are grouped across concurrent requests.
+# Set ATTENTION_LENS_MAX_BATCH=1 to run every request on its own.
+batcher = MicroBatcher(
+    max_batch_size=int(os.environ.get("ATTENTION_LENS_MAX_BATCH", "8")),
+    max_wait_ms=float(os.environ.get("ATTENTION_LENS_MAX_WAIT_MS", "2")),
+    num_threads=int(os.environ.get("ATTENTION_LENS_BATCH_THREADS", "0")) or None,
+)
+
+# Inference runs on a dedicated pool instead of FastAPI's default threadpool,
+# with bounded concurrency, queueing and per-request timeouts
+executor = InferenceExecutor(
+    workers=int(os.environ.get("ATTENTION_LENS_WORKERS", "4")),
+    threads_per_worker=int(os.environ.get("ATTENTION_LENS_THREADS_PER_WORKER", "0")) or None,
+    max_queue=int(os.environ.get("ATTENTION_LENS_MAX_QUEUE", "64")),
+    timeout=float(os.environ.get("ATTENTION_LENS_REQUEST_TIMEOUT", "30")),
+)
+
+# Other checkpoints a request can select with "model" (see registry.py):
+# every checkpoint in ATTENTION_LENS_CHECKPOINTS, loaded on first use and
+# unloaded least recently used first past ATTENTION_LENS_MODEL_MEMORY_MB
+DEFAULT_MODEL = "default"
+STARTUP_MODEL = "startup"  # the model loaded at startup, even after another is activated
+registry = ModelRegistry(
+    os.environ.get("ATTENTION_LENS_CHECKPOINTS", os.path.join(os.path.dirname(__file__), "..", "checkpoints")),
+    max_bytes=int(os.environ.get("ATTENTION_LENS_MODEL_MEMORY_MB", "2048")) * 1024 * 1024,
+    # Derived data is kept per checkpoint hash and must go with the model
+    on_unload=(forget_spectra, forget_indexes, forget_projections, forget_variants),
+)
+# The model serving the current request (carried to inference workers like
+# the metrics record); request code reads it through active_model()
+_active_model = contextvars.ContextVar("attention_lens_model", default=None)
+
+def active_model():
+    return _active_model.get() or model
+
+class ModelLoading(Exception):
+    """Raised by handlers that need the model before it has finished loading"""
+
+def require_model():
+    if not model_ready.is_set():
+        raise ModelLoading()
+
+def inference(fn):
+    """Run a handler on the inference executor once the model is ready, with
+    the checkpoint selected by the request's ``model`` field as active_model()"""
+    @functools.wraps(fn)
+    async def wrapper(*args, **kwargs):
+        require_model()
+        name = kwargs.get("model_name") or next((value.model for value in (*args, *kwargs.values())
+                                                 if isinstance(value, BaseModel) and getattr(value, "model", None)), None)
+        handler = functools.partial(call_with_model, name, fn)
+        return await executor.run(run_handler, handler, time.perf_counter(), args, kwargs)
+    return wrapper
+
+def select_model(name):
+    if name is None or name == DEFAULT_MODEL:
+        return model
+    try:
+        return registry.get(name)
+    except KeyError:
+        available = ", ".join([DEFAULT_MODEL, *registry.checkpoints()])
+        raise HTTPException(status_code=404, detail=f"Unknown model {name}. Available: {available}")
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@contextmanager
+def use_model(selected):
+    """Make ``selected`` the active_model() inside the block"""
+    token = _active_model.set(selected)
+    try:
+        yield
+    finally:
+        _active_model.reset(token)
+
+def call_with_model(name, fn, /, *args, **kwargs):
+    # The default model is fixed for the whole request, even if another one
+    # is activated while it runs
+    selected = model
+    if name is not None:
+        with stage("load_model"):
+            selected = select_model(name)
+    with use_model(selected):
+        return fn(*args, **kwargs)
+
+# Per-request stage timings and Prometheus metrics (see /metrics). With
+# ATTENTION_LENS_PROFILING=1 a request sent with "X-Profile: 1" (or a random
+# ATTENTION_LENS_PROFILE_SAMPLE fraction of requests) also records a
+# torch.profiler trace, served from /profiles/{trace id}.
+metrics = Metrics()
+PROFILING = os.environ.get("ATTENTION_LENS_PROFILING") == "1"
+PROFILE_SAMPLE = float(os.environ.get("ATTENTION_LENS_PROFILE_SAMPLE", "0"))
+PROFILE_DIR = os.environ.get(
+    "ATTENTION_LENS_PROFILE_DIR", os.path.join(tempfile.gettempdir(), "attention-lens-profiles")
+)
+# torch.profiler is process-wide: overlapping sessions crash the profiler
+# backend, so only one request is traced at a time
+profiler_lock = threading.Lock()
+
+def run_handler(fn, submitted, args, kwargs):
+    """Call a handler on an inference worker, recording its stages on the request.
+
+    ``queue`` is the wait for a worker; handler time not attributed to a finer
+    stage (``tokenize``, ``forward``, ...) counts as ``postprocess``.
+    """
+    record = current_request()
+    if record is None:
+        return fn(*args, **kwargs)
+    record.add_stage("queue", time.perf_counter() - submitted)
+    profiler = None
+    if record.profile and not profiler_lock.acquire(blocking=False):
+        # Another request is being traced; run this one untraced
+        record.profile = False
+    if record.profile:
+        try:
+            with stage("profile"):
+                profiler = torch.profiler.profile(
+                    activities=[torch.profiler.ProfilerActivity.CPU], record_shapes=True, profile_memory=True
+                )
+                profiler.start()
+        except BaseException:
+            profiler_lock.release()
+            raise
+    started = time.perf_counter()
+    timed_before = sum(record.stages.values())
+    try:
+        result = fn(*args, **kwargs)
+    finally:
+        done = time.perf_counter()
+        record.add_stage("postprocess", (done - started) - (sum(record.stages.values()) - timed_before))
+        if profiler is not None:
+            try:
+                with stage("profile"):
+                    profiler.stop()
+            finally:
+                profiler_lock.release()
+    
+    if profiler is not None:
+        with stage("profile"):
+            os.makedirs(PROFILE_DIR, exist_ok=True)
+            record.trace_id = uuid.uuid4().hex[:16]
+            profiler.export_chrome_trace(os.path.join(PROFILE_DIR, f"{record.trace_id}.json"))
+    record.handler_done = time.perf_counter()
+    return result
+
+@app.middleware("http")
+async def instrument_request(request: Request, call_next):
+    profile = PROFILING and (request.headers.get("x-profile") == "1" or random.random() < PROFILE_SAMPLE)
+    record, token = start_request(profile)
+    try:
+        response = await call_next(request)
+    finally:
+        end_request(token)
+    
+    now = time.perf_counter()
+    if record.handler_done is not None:
+        # Rendering the handler's return value (e.g. JSON encoding) happens after it returns
+        record.add_stage("serialize", now - record.handler_done)
+    total = now - record.started
+    route = request.scope.get("route")
+    content_length = response.headers.get("content-length")
+    metrics.observe(
+        route.path if route is not None else "unmatched", request.method, response.status_code, record, total,
+        int(content_length) if content_length is not None else None
+    )
+    response.headers["Server-Timing"] = server_timing(record, total)
+    if record.trace_id is not None:
+        response.headers["X-Profile-Trace"] = record.trace_id
+    return response
+
+@app.exception_handler(ModelLoading)
+async def model_loading_handler(request: Request, exc: ModelLoading):
+    detail = "Model failed to load" if load_state["status"] == "error" else "Model is still loading"
+    return JSONResponse(status_code=503, content={"detail": detail}, headers={"Retry-After": "1"})
 
-class TextRequest(BaseModel):
+@app.exception_handler(Overloaded)
+async def overloaded_handler(request: Request, exc: Overloaded):
+    return JSONResponse(
+        status_code=503,
+        content={"detail": "Server is busy, try again shortly"},
+        headers={"Retry-After": "1"}
+    )
+
+@app.exception_handler(asyncio.TimeoutError)
+async def timeout_handler(request: Request, exc: asyncio.TimeoutError):
+    return JSONResponse(status_code=504, content={"detail": "Inference timed out"})
+
+class ModelRequest(BaseModel):
+    model: Optional[str] = None  # checkpoint from /models (default: the served model)
+
+class TextRequest(ModelRequest):
     text: str
     top_k: int = 10
 
+def encode_text(text):
+    require_model()
+    if not text:
+        raise HTTPException(status_code=400, detail="Text cannot be empty")
+    with stage("tokenize"):
+        return enc.encode(text)
+
+def tensor_response(http_request, payload):
+    """Return a payload holding tensors as JSON lists, or in the compact binary
+    format when the client asks for it through the Accept header"""
+    dtype = negotiate(http_request.headers.get("accept"))
+    with stage("serialize"):
+        if dtype is None:
+            return to_json_compatible(payload)
+        return Response(content=encode_payload(payload, dtype), media_type=MEDIA_TYPE)
+
+def check_length(ids):
+    model = active_model()
+    if len(ids) > model.context_len:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Input is {len(ids)} tokens but the model context is {model.context_len}; use /analyze-long for longer texts"
+        )
+
+# Activations (see model.CAPTURES) each analysis needs from the forward pass
+SECTION_CAPTURES = {
+    "predictions": ("logits",),
+    "attention": ("pattern",),
+    "activations": ("z", "hidden_state"),
+    "token_predictions": ("logits",),
+    "eigenvalues": ("pattern",),
+    "induction": ("pattern",),
+    "logit_lens": ("embed", "logits"),
+}
+# Everything the analyses need between them. A pass for any of them captures
+# all of these, so one prompt viewed across the dashboard runs the model once.
+ANALYSIS_CAPTURES = frozenset().union(*SECTION_CAPTURES.values())
+
+def run_forward(ids, capture, complete=True):
+    """Run the model on a single sequence of token IDs, reusing cached outputs.
+
+    Returns a dict holding at least the ``capture``d activations, each with a
+    batch dimension of 1. Activations already cached for these IDs are
+    reused. On a miss the pass also computes the rest of ANALYSIS_CAPTURES
+    for the other endpoints, unless ``complete`` is False (for callers such
+    as /capture that ask for specific activations only). The tensors may be
+    shared with other requests and must not be modified in place.
+    """
+    model = active_model()
+    check_length(ids)
+    key = (model.version, tuple(ids))
+    # A profiled request runs its own pass on this thread so it shows up in the trace
+    outputs = {} if profiling() else forward_cache.get(key) or {}
+    missing = set(capture) - outputs.keys()
+    if missing:
+        if complete:
+            missing |= ANALYSIS_CAPTURES - outputs.keys()
+        with stage("forward"):
+            # The pass runs on this request's model, whatever becomes the
+            # default meanwhile, so outputs always match the key they are cached under
+            if profiling():
+                with torch.no_grad():
+                    computed = model(torch.tensor([ids]), capture=missing)
+            else:
+                computed = batcher.run(model, ids, missing)
+        outputs = {**outputs, **computed}
+        forward_cache.put(key, outputs)
+    record_tensors({name: outputs[name] for name in capture})
+    return outputs
+
+def stored(analysis, ids, params, compute):
+    """``compute()``, or its result read from the result store if the same
+    analysis of ``ids`` with the same ``params`` was computed before for this
+    checkpoint (possibly before a restart)"""
+    model = active_model()
+    if result_store is None or profiling():
+        return compute()
+    key = result_key(analysis, model.version, ids, params)
+    with stage("store"):
+        result = result_store.get(key)
+    if result is None:
+        result = compute()
+        with stage("store"):
+            result_store.put(key, analysis, model.version, len(ids), result)
+    return result
+
+def load_runtime():
+    global model, enc, token_strings
+    started = time.perf_counter()
+    load_state["status"] = "loading"
+    try:
+        loaded_model, loaded_enc = load_model(shared_dir=SHARED_WEIGHTS_DIR)
+        token_strings = loaded_enc.decode_batch([[i] for i in range(loaded_enc.n_vocab)])
+        model, enc = loaded_model, loaded_enc
+        registry.vocab_size = enc.n_vocab
+        registry.pin(DEFAULT_MODEL, model)
+        registry.pin(STARTUP_MODEL, model)
+    except Exception as e:
+        print(f"Error loading model: {e}")
+        load_state.update(status="error", error=str(e))
+        return
+    load_state.update(status="ready", seconds=time.perf_counter() - started)
+    model_ready.set()
+
+    # Weight-only analyses are loaded from disk or computed after the model
+    # is ready; endpoints that need one before then compute it on demand
+    get_circuit_spectra(model)
+    for space in SPACES:
+        get_index(model, space)
+    get_vocab_projection(model)
+    get_subset_projection(model, list(range(min(1000, model.vocab_size))))
+
+@app.on_event("startup")
+def start_loading():
+    threading.Thread(target=load_runtime, name="model-loader", daemon=True).start()
+
 @app.get("/")
 def read_root():
     return {"message": "Mechanistic Interpretability Backend"}
 
+@app.get("/health")
+def health():
+    """Liveness: the process is up, whether or not the model has loaded"""
+    return {"status": "ok"}
+
+@app.get("/ready")
+def ready():
+    """Readiness: 200 once the model and tokenizer are loaded, 503 until then"""
+    body = {**load_state, "model_version": model.version if model is not None else None}
+    if not model_ready.is_set():
+        return JSONResponse(status_code=503, content=body)
+    return body
+
+@app.get("/cache")
+def get_cache_stats():
+    return forward_cache.stats()
+
+@app.get("/batching")
+def get_batching_stats():
+    return batcher.stats()
+
+@app.get("/executor")
+def get_executor_stats():
+    return executor.stats()
+
+@app.get("/metrics")
+def get_metrics():
+    """Request, stage and tensor-size histograms per route, plus cache, batching,
+    executor and session statistics, in the Prometheus text format"""
+    gauges = {}
+    for group, stats in (("cache", forward_cache.stats()), ("batching", batcher.stats()),
+                         ("executor", executor.stats()), ("sessions", sessions.stats()),
+                         ("result_store", result_store.stats() if result_store else {}),
+                         ("models", registry.stats())):
+        for name, value in stats.items():
+            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                gauges[f"{group}_{name}"] = value
+    gauges["model_ready"] = int(model_ready.is_set())
+    return Response(content=metrics.render(gauges), media_type="text/plain; version=0.0.4")
+
+@app.get("/results")
+def get_result_store_stats():
+    if result_store is None:
+        raise HTTPException(status_code=404, detail="The result store is disabled")
+    return result_store.stats()
+
+@app.get("/results/export")
+def export_results(model_version: Optional[str] = None):
+    """Download the stored results (optionally of one checkpoint) as a SQLite
+    database for POST /results/import or ``result_store.py import``"""
+    if result_store is None:
+        raise HTTPException(status_code=404, detail="The result store is disabled")
+    fd, path = tempfile.mkstemp(suffix=".sqlite3")
+    os.close(fd)
+    result_store.export(path, model_version)
+    return FileResponse(path, media_type="application/vnd.sqlite3", filename="attention-lens-results.sqlite3",
+                        background=BackgroundTask(os.remove, path))
+
+@app.post("/results/import")
+async def import_results(request: Request):
+    """Add the results of an exported database (sent as the request body)"""
+    if result_store is None:
+        raise HTTPException(status_code=404, detail="The result store is disabled")
+    fd, path = tempfile.mkstemp(suffix=".sqlite3")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            async for chunk in request.stream():
+                f.write(chunk)
+        added = await asyncio.to_thread(result_store.import_from, path)
+    except (ValueError, sqlite3.DatabaseError) as e:
+        raise HTTPException(status_code=400, detail=f"Could not import results: {e}")
+    finally:
+        os.remove(path)
+    return {"imported": added, **result_store.stats()}
+
+@app.delete("/results")
+def clear_results():
+    if result_store is None:
+        raise HTTPException(status_code=404, detail="The result store is disabled")
+    result_store.clear()
+    return {"cleared": True}
+
+@app.get("/models")
+def list_models():
+    """Checkpoints requests can select with "model", and which are loaded"""
+    require_model()
+    return {"default": model.version, "models": registry.describe(), **registry.stats()}
+
+@app.post("/models/{name}/activate")
+@inference
+def activate_model(name: str):
+    """Serve checkpoint ``name`` as the default model from now on, without a restart"""
+    global model
+    selected = select_model(name)
+    model = selected
+    registry.pin(DEFAULT_MODEL, selected)
+    print(f"Now serving {name} ({selected.version[:16]}) as the default model")
+    return {"default": name, "version": selected.version, "config": selected.config}
+
+@app.delete("/models/{name}")
+def unload_model(name: str):
+    """Free a loaded checkpoint (it is loaded again if a request selects it)"""
+    if not registry.unload(name):
+        raise HTTPException(status_code=404, detail=f"Model {name} is not loaded or cannot be unloaded")
+    return {"unloaded": name}
+
+@app.get("/profiles/{trace_id}")
+def get_profile(trace_id: str):
+    """A torch.profiler trace recorded for a request (open in chrome://tracing or Perfetto)"""
+    path = os.path.join(PROFILE_DIR, f"{trace_id}.json")
+    if not trace_id.isalnum() or not os.path.isfile(path):
+        raise HTTPException(status_code=404, detail="Unknown profile trace")
+    return FileResponse(path, media_type="application/json")
+
+def decode_tokens(ids):
+    return [token_strings[i] for i in ids]
+
+def top_k_predictions(logits, top_k):
+    """Top-k next tokens for every row of ``logits`` [..., vocab_size] at once.
+
+    Returns (probs, ids) as nested Python lists shaped [..., top_k], plus the
+    full log-probabilities for gathering other tokens' probabilities.
+    """
+    log_probs = F.log_softmax(logits.float(), dim=-1)
+    top_k_log_probs, top_k_indices = torch.topk(log_probs, top_k, dim=-1)
+    return top_k_log_probs.exp().tolist(), top_k_indices.tolist(), log_probs
+
+def prediction_list(probs, token_ids, with_ids=True):
+    if with_ids:
+        return [{"token": token_strings[i], "prob": p, "id": i} for p, i in zip(probs, token_ids)]
+    return [{"token": token_strings[i], "prob": p} for p, i in zip(probs, token_ids)]
+
+class PredictRequest(TextRequest):
+    precision: str = "fp32"
+
 @app.post("/predict")
-def predict_next_token(request: TextRequest):
-    text = request.text
-    if not text:
-        raise HTTPException(status_code=400, detail="Text cannot be empty")
-    
+@inference
+def predict_next_token(request: PredictRequest):
     # Encode input
-    ids = enc.encode(text)
-    # Convert to tensor and add batch dimension
-    input_tensor = torch.tensor(ids).unsqueeze(0)
-    
-    # Forward pass
-    with torch.no_grad():
-        logits = model(input_tensor)
+    ids = encode_text(request.text)
     
-    # Get logits for the last token
-    last_token_logits = logits[0, -1, :]
+    if request.precision == "fp32":
+        # Forward pass (shared with the other endpoints through the cache)
+        return stored("predictions", ids, {"top_k": request.top_k},
+                      lambda: compute_predictions(ids, run_forward(ids, SECTION_CAPTURES["predictions"]), request.top_k))
     
-    # Calculate probabilities
-    probs = F.softmax(last_token_logits, dim=-1)
+    # Reduced precision, unembedding only the last position
+    variant = precision_variant(request.precision)
+    check_length(ids)
+    with torch.no_grad():
+        outputs = variant(torch.tensor([ids]), positions=[-1], capture=("logits",))
+    return {**compute_predictions(ids, outputs, request.top_k), "precision": request.precision}
+
+def precision_variant(precision):
+    model = active_model()
+    try:
+        return get_variant(model, precision)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+class PrecisionReportRequest(ModelRequest):
+    text: str
+    precisions: list[str] = list(PRECISIONS)
+    repeats: int = 5
+
+@app.post("/precision-report")
+@inference
+def get_precision_report(request: PrecisionReportRequest):
+    """Accuracy and latency of each reduced-precision mode against fp32"""
+    model = active_model()
+    ids = encode_text(request.text)
+    check_length(ids)
+    if not 1 <= request.repeats <= 100:
+        raise HTTPException(status_code=400, detail="repeats must be between 1 and 100")
+    variants = {precision: precision_variant(precision) for precision in request.precisions}
+    return {
+        "tokens": len(ids),
+        "report": {
+            precision: accuracy_report(model, variant, ids, repeats=request.repeats)
+            for precision, variant in variants.items()
+        }
+    }
+
+def compute_predictions(ids, outputs, top_k):
+    logits = outputs["logits"]
     
-    # Get top-k
-    top_k_probs, top_k_indices = torch.topk(probs, request.top_k)
+    # Top-k probabilities for the last token
+    top_k_probs, top_k_indices, _ = top_k_predictions(logits[0, -1, :], top_k)
     
-    predictions = []
-    for i in range(request.top_k):
-        token_id = top_k_indices[i].item()
-        token_str = enc.decode([token_id])
-        prob = top_k_probs[i].item()
-        predictions.append({"token": token_str, "prob": prob, "id": token_id})
-        
-    return {"predictions": predictions}
+    return {"predictions": prediction_list(top_k_probs, top_k_indices)}
+
+class TensorViewRequest(TextRequest):
+    # Optional reductions of the returned tensors (see views.py); with none
+    # set the full tensors are returned as before
+    heads: Optional[list[int]] = None          # subset of heads, in this order
+    positions: Optional[list[int]] = None      # [start, end) of query/token positions
+    key_positions: Optional[list[int]] = None  # [start, end) of attended positions (attention only)
+    pool: int = 1                              # pool positions in tiles of this size
+    pool_mode: str = "mean"                    # "mean" or "max"
+    row_top_k: Optional[int] = None            # sparse: keep the k largest entries of each row
+    threshold: Optional[float] = None          # sparse: keep entries with magnitude >= threshold
+
+def view_options(request, T):
+    """Validated view options of a TensorViewRequest for a T-token input"""
+    model = active_model()
+    if request.pool < 1:
+        raise HTTPException(status_code=400, detail="pool must be positive")
+    if request.pool_mode not in POOL_MODES:
+        raise HTTPException(status_code=400, detail=f"pool_mode must be one of {', '.join(POOL_MODES)}")
+    if request.row_top_k is not None and request.row_top_k < 1:
+        raise HTTPException(status_code=400, detail="row_top_k must be positive")
+    try:
+        return {
+            "heads": head_subset(request.heads, model.n_heads),
+            "positions": list(position_range(request.positions, T, "positions")),
+            "key_positions": list(position_range(request.key_positions, T, "key_positions")),
+            "pool": request.pool,
+        }
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
 @app.post("/attention")
-def get_attention(request: TextRequest):
-    text = request.text
-    if not text:
-        raise HTTPException(status_code=400, detail="Text cannot be empty")
-        
-    ids = enc.encode(text)
-    input_tensor = torch.tensor(ids).unsqueeze(0)
-    
-    with torch.no_grad():
-        # return_all=True returns: logits, scores, pattern, v, z, hidden_state
-        _, _, pattern, _, _, _ = model(input_tensor, return_all=True)
+@inference
+def get_attention(request: TensorViewRequest, http_request: Request):
+    ids = encode_text(request.text)
+    view = view_options(request, len(ids))
+    result = stored("attention", ids, {}, lambda: compute_attention(ids, run_forward(ids, SECTION_CAPTURES["attention"])))
+    with stage("view"):
+        result["attention"] = attention_view(result["attention"], view, request)
+    result["tokens"] = decode_tokens(ids)
+    result["view"] = view
+    return tensor_response(http_request, result)
+
+def compute_attention(ids, outputs):
+    pattern = outputs["pattern"]
     
     # pattern shape: [B, n_heads, T, T]
-    # We want to return it as a list/array
-    # Remove batch dim
-    attention_matrix = pattern[0].cpu().numpy().tolist()
+    # Remove batch dim; converted to lists or binary by tensor_response
+    attention_matrix = pattern[0]
     
-    tokens = [enc.decode([i]) for i in ids]
+    return {"attention": attention_matrix}
+
+def attention_view(pattern, view, request):
+    # pattern [n_heads, T, T] -> [heads, queries, keys], pooled over
+    # query x key tiles and optionally sparse
+    model = active_model()
+    (q_start, q_end), (k_start, k_end) = view["positions"], view["key_positions"]
+    if view["heads"] != list(range(model.n_heads)):
+        pattern = pattern[view["heads"]]
+    pattern = pattern[:, q_start:q_end, k_start:k_end]
+    pattern = pool_last_dims(pattern, request.pool, 2, request.pool_mode)
+    return encode_view(pattern, request.row_top_k, request.threshold)
+
+class EmbeddingSubsetRequest(ModelRequest):
+    token_ids: list[int] = []
+    words: list[str] = []
+    fit: str = "subset"  # "subset": PCA fitted on these tokens; "vocab": full-vocabulary PCA
+
+def embedding_points(ids, coords):
+    coords = coords.tolist()
+    return [
+        {"token": token_strings[idx], "x": xy[0], "y": xy[1], "id": idx}
+        for idx, xy in zip(ids, coords)
+    ]
+
+def projected_embeddings(ids, fit):
+    model = active_model()
+    if fit == "subset":
+        return embedding_points(ids, get_subset_projection(model, ids)["coords"])
+    if fit == "vocab":
+        return embedding_points(ids, get_vocab_projection(model)["coords"][ids])
+    raise HTTPException(status_code=400, detail=f"Unknown fit: {fit} (use 'subset' or 'vocab')")
+
+@app.get("/embeddings")
+@inference
+def get_embeddings(offset: int = 0, limit: int = 1000, fit: str = "subset",
+                   model_name: Optional[str] = Query(None, alias="model")):
+    # 2D PCA of token embeddings, one page of token IDs [offset, offset + limit)
+    # at a time. By default the PCA is fitted on the page itself (the first
+    # 1000 tokens unless paged); fit="vocab" places the page in the
+    # full-vocabulary projection so pages can be combined into one scatter plot.
+    # Projections are cached in projections.py, so repeat calls do no PCA work.
+    model = active_model()
+    if offset < 0 or limit < 1:
+        raise HTTPException(status_code=400, detail="offset must be >= 0 and limit positive")
+    indices = list(range(offset, min(offset + limit, model.vocab_size)))
+    if not indices:
+        raise HTTPException(status_code=400, detail="offset is past the end of the vocabulary")
     
+    next_offset = indices[-1] + 1
     return {
-        "attention": attention_matrix,
-        "tokens": tokens
+        "embeddings": projected_embeddings(indices, fit),
+        "total": model.vocab_size,
+        "next_offset": next_offset if next_offset < model.vocab_size else None
     }
 
-@app.get("/embeddings")
-def get_embeddings():
-    # Return PCA of embeddings
-    # We'll compute PCA on the fly or return raw embeddings if frontend does PCA?
-    # The request said "PCA for the embeddings". 
-    # Let's do PCA here to save bandwidth, or return a subset.
-    # The vocab size is 50k, sending all embeddings is too much.
-    # Let's send a subset of interesting words or just top K frequent ones if we had frequencies.
-    # For now, let's pick a random subset or a fixed list of common words.
-    
-    # Actually, let's just return the weights for a small subset of words for visualization
-    # or perform PCA on the server.
-    
-    from sklearn.decomposition import PCA
-    
-    # Get all embeddings
-    W_E = model.W_E.weight.detach().cpu().numpy()
-    
-    # Pick a subset to visualize to keep it fast
-    # Let's take first 1000 tokens or a specific list
-    indices = list(range(0, 1000))
-    subset = W_E[indices]
-    
-    pca = PCA(n_components=2)
-    coords = pca.fit_transform(subset)
-    
-    data = []
-    for i, idx in enumerate(indices):
-        token = enc.decode([idx])
-        data.append({
-            "token": token,
-            "x": float(coords[i, 0]),
-            "y": float(coords[i, 1]),
-            "id": idx
-        })
-        
-    return {"embeddings": data}
+@app.post("/embeddings/subset")
+@inference
+def get_embedding_subset(request: EmbeddingSubsetRequest):
+    """PCA projection of an arbitrary set of tokens"""
+    model = active_model()
+    ids = list(request.token_ids)
+    for word in request.words:
+        word_ids = enc.encode(word)
+        if word_ids:
+            # Use the first token if multiple, as /analogy does
+            ids.append(word_ids[0])
+    ids = list(dict.fromkeys(ids))
+    if not ids:
+        raise HTTPException(status_code=400, detail="Provide at least one word or token ID")
+    if any(i < 0 or i >= model.vocab_size for i in ids):
+        raise HTTPException(status_code=400, detail="Token ID out of range")
+    return {"embeddings": projected_embeddings(ids, request.fit)}
 
-@app.post("/activations")
-def get_activations(request: TextRequest):
-    text = request.text
-    if not text:
-        raise HTTPException(status_code=400, detail="Text cannot be empty")
-        
-    ids = enc.encode(text)
-    input_tensor = torch.tensor(ids).unsqueeze(0)
+@app.get("/embeddings/stream")
+@inference
+def stream_embeddings(page_size: int = 5000, model_name: Optional[str] = Query(None, alias="model")):
+    """The full-vocabulary projection as newline-delimited JSON pages"""
+    model = active_model()
+    if page_size < 1:
+        raise HTTPException(status_code=400, detail="page_size must be positive")
+    coords = get_vocab_projection(model)["coords"]
     
-    with torch.no_grad():
-        # return_all=True returns: logits, scores, pattern, v, z, hidden_state
-        _, _, _, _, z, hidden_state = model(input_tensor, return_all=True)
+    def pages():
+        for start in range(0, model.vocab_size, page_size):
+            ids = list(range(start, min(start + page_size, model.vocab_size)))
+            yield json.dumps({"offset": start, "total": model.vocab_size, "embeddings": embedding_points(ids, coords[ids])}) + "\n"
+    
+    # Pages are built on an executor worker as the response is sent, as in /analyze-long
+    return StreamingResponse(executor.stream(pages()), media_type="application/x-ndjson")
+
+@app.post("/activations")
+@inference
+def get_activations(request: TensorViewRequest, http_request: Request):
+    ids = encode_text(request.text)
+    view = view_options(request, len(ids))
+    del view["key_positions"]
+    result = stored("activations", ids, {}, lambda: compute_activations(ids, run_forward(ids, SECTION_CAPTURES["activations"])))
+    with stage("view"):
+        result.update(activations_view(result, view, request))
+    result["tokens"] = decode_tokens(ids)
+    result["view"] = view
+    return tensor_response(http_request, result)
+
+def activations_view(result, view, request):
+    # activations [T, d_model] and attention_output [T, n_heads, d_head]:
+    # positions cut and pooled along T, heads picked from attention_output,
+    # each vector along the last dimension optionally sparse by magnitude
+    model = active_model()
+    start, end = view["positions"]
+    hidden_state = result["activations"][start:end]
+    z = result["attention_output"][start:end]
+    if view["heads"] != list(range(model.n_heads)):
+        z = z[:, view["heads"]]
+    hidden_state = pool_last_dims(hidden_state.T, request.pool, 1, request.pool_mode).T
+    T, H, d = z.shape
+    z = pool_last_dims(z.reshape(T, H * d).T, request.pool, 1, request.pool_mode).T.reshape(-1, H, d)
+    return {
+        "activations": encode_view(hidden_state, request.row_top_k, request.threshold),
+        "attention_output": encode_view(z, request.row_top_k, request.threshold)
+    }
+
+def compute_activations(ids, outputs):
+    model = active_model()
+    z, hidden_state = outputs["z"], outputs["hidden_state"]
     
     # z shape: [B, T, n_heads * d_head] -> reshape to [B, T, n_heads, d_head]
     # hidden_state shape: [B, T, d_model]
@@ -152,77 +775,85 @@ def get_activations(request: TextRequest):
     z_reshaped = z.view(B, T, model.n_heads, model.d_head)
     
     return {
-        "activations": hidden_state[0].cpu().numpy().tolist(),
-        "attention_output": z_reshaped[0].cpu().numpy().tolist(),
-        "tokens": [enc.decode([i]) for i in ids]
+        "activations": hidden_state[0],
+        "attention_output": z_reshaped[0]
     }
 
+class CaptureRequest(ModelRequest):
+    text: str
+    names: list[str]  # any of model.CAPTURES
+
+@app.post("/capture")
+@inference
+def capture_activations(request: CaptureRequest, http_request: Request):
+    """Return exactly the named activations of a forward pass (batch dimension removed)"""
+    unknown = [name for name in request.names if name not in CAPTURES]
+    if unknown:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Unknown activations: {', '.join(unknown)}. Available: {', '.join(CAPTURES)}"
+        )
+    ids = encode_text(request.text)
+    outputs = run_forward(ids, request.names, complete=False)
+    result = {name: outputs[name][0] for name in request.names}
+    result["tokens"] = decode_tokens(ids)
+    return tensor_response(http_request, result)
+
 @app.get("/weights")
-def get_weight_analysis():
-    # Compute eigenvalues of attention heads (W_OV = W_V @ W_O) or just W_Q, W_K?
-    # The user mentioned "eigenvalue of heads". Usually this refers to the OV circuit or QK circuit.
-    # OV circuit: W_V @ W_O
-    # QK circuit: W_Q @ W_K.T
-    
-    # Let's compute SVD/Eigenvalues of W_OV for each head
+@inference
+def get_weight_analysis(http_request: Request, top: int = 10, include_factors: bool = False,
+                        model_name: Optional[str] = Query(None, alias="model")):
+    # Singular values of each head's OV circuit (W_O[h] @ W_V[h], what a head
+    # writes given what it attends to) and QK circuit (W_Q[h]^T @ W_K[h], where
+    # it attends). The weights never change between requests, so the spectra
+    # are computed once per checkpoint in circuits.py and served from memory.
+    model = active_model()
+    spectra = get_circuit_spectra(model)
     
     analysis = []
-    
-    W_Q = model.W_Q.weight # [n_heads * d_head, d_model]
-    W_K = model.W_K.weight
-    W_V = model.W_V.weight
-    W_O = model.W_O.weight # [d_model, n_heads * d_head]
-    
-    # Reshape to [n_heads, d_head, d_model]
-    W_Q_heads = W_Q.view(model.n_heads, model.d_head, model.d_model)
-    W_K_heads = W_K.view(model.n_heads, model.d_head, model.d_model)
-    W_V_heads = W_V.view(model.n_heads, model.d_head, model.d_model)
-    
-    # W_O is [d_model, n_heads * d_head]. We need to split the input dim.
-    # W_O_heads = W_O.view(d_model, n_heads, d_head).transpose(0, 1) # [n_heads, d_model, d_head]
-    # Actually W_O weights are usually stored as [d_model, n_heads * d_head] in PyTorch Linear layer (out, in)
-    # But here W_O maps from [n_heads * d_head] to [d_model].
-    # So weight shape is [d_model, n_heads * d_head].
-    
-    W_O_heads = W_O.view(model.d_model, model.n_heads, model.d_head).permute(1, 0, 2) # [n_heads, d_model, d_head]
-    
     for h in range(model.n_heads):
-        # OV Matrix: W_V[h] @ W_O[h] (approx, depends on definition)
-        # W_V[h]: [d_head, d_model]
-        # W_O[h]: [d_model, d_head] -> Wait, W_O takes d_head and maps to d_model.
-        # So effective OV matrix for head h is W_V[h] (d_model -> d_head) then W_O[h] (d_head -> d_model)
-        # Matrix = W_O[h] @ W_V[h] : [d_model, d_model]
-        
-        w_v = W_V_heads[h] # [d_head, d_model]
-        w_o = W_O_heads[h] # [d_model, d_head]
-        
-        # OV = w_o @ w_v # [d_model, d_model]
-        OV = torch.matmul(w_o, w_v)
-        
-        # Compute eigenvalues (use SVD for stability/singular values)
-        # Eigenvalues might be complex. Singular values are real.
-        # "Eigenvalue of heads" usually implies checking if they copy or negate.
-        
-        # Let's return singular values
-        U, S, V = torch.svd(OV)
-        
-        analysis.append({
+        head = {
             "head": h,
-            "singular_values": S.detach().cpu().numpy().tolist()[:10] # Top 10
-        })
-        
-    return {"analysis": analysis}
+            "singular_values": spectra["ov_singular_values"][h, :top].tolist(),
+            "qk_singular_values": spectra["qk_singular_values"][h, :top].tolist()
+        }
+        if include_factors:
+            # Rank-d_head factors: circuit = U @ diag(S) @ V^T
+            for name in ("ov_U", "ov_V", "qk_U", "qk_V"):
+                head[name] = spectra[name][h]
+        analysis.append(head)
+    
+    return tensor_response(http_request, {"analysis": analysis})
 
-class AnalogyRequest(BaseModel):
+class AnalogyRequest(ModelRequest):
     positive: list[str]
     negative: list[str]
     top_k: int = 5
+    mode: str = "exact"  # "exact" or "approx" (IVF index)
+    nprobe: int = 8
 
-@app.post("/analogy")
-def get_analogy(request: AnalogyRequest):
+class AnalogyBatchRequest(ModelRequest):
+    # The batch's model applies to every analogy in it
+    analogies: list[AnalogyRequest]
+
+class NearestTokensRequest(ModelRequest):
+    words: list[str] = []
+    token_ids: list[int] = []
+    space: str = "embed"  # "embed" (W_E) or "unembed" (W_U)
+    top_k: int = 10
+    mode: str = "exact"
+    nprobe: int = 8
+
+def search_index(space, queries, k, mode, nprobe):
+    try:
+        return get_index(active_model(), space).search(queries, k, mode=mode, nprobe=nprobe)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+def analogy_target(request):
     # Vector arithmetic: pos1 + pos2 - neg1
     # We use the embedding matrix W_E
-    
+    model = active_model()
     W_E = model.W_E.weight.detach() # [vocab_size, d_model]
     
     target_vector = torch.zeros(model.d_model)
@@ -239,24 +870,19 @@ def get_analogy(request: AnalogyRequest):
         if not ids: continue
         idx = ids[0]
         target_vector -= W_E[idx]
-        
-    # Find closest vectors (cosine similarity)
-    # Normalize target
-    target_norm = F.normalize(target_vector.unsqueeze(0), dim=1)
-    W_E_norm = F.normalize(W_E, dim=1)
-    
-    # Similarity: target @ W_E.T
-    sims = torch.matmul(target_norm, W_E_norm.T).squeeze()
-    
-    # Get top-k
-    top_k_sims, top_k_indices = torch.topk(sims, request.top_k + len(request.positive) + len(request.negative))
     
+    return target_vector
+
+def analogy_results(request, top_k_sims, top_k_indices):
     results = []
     input_words = set(request.positive + request.negative)
     
     for i in range(len(top_k_indices)):
         idx = top_k_indices[i].item()
-        token = enc.decode([idx])
+        if idx < 0:
+            # Approximate search found fewer candidates than requested
+            break
+        token = token_strings[idx]
         
         # Filter out input words to find "new" result
         # This is a rough filter since tokenization might differ
@@ -273,265 +899,678 @@ def get_analogy(request: AnalogyRequest):
         if len(results) >= request.top_k:
             break
             
-    return {"results": results}
+    return results
+
+def run_analogies(analogies):
+    """Solve many analogies with one similarity search over the normalized W_E"""
+    if not analogies:
+        return []
+    targets = torch.stack([analogy_target(a) for a in analogies])
+    
+    # Over-fetch so input words can be filtered out of the results
+    k = max(a.top_k + len(a.positive) + len(a.negative) for a in analogies)
+    
+    # Queries sharing a search mode are scored together
+    results = [None] * len(analogies)
+    for mode, nprobe in {(a.mode, a.nprobe) for a in analogies}:
+        rows = [i for i, a in enumerate(analogies) if (a.mode, a.nprobe) == (mode, nprobe)]
+        sims, indices = search_index("embed", targets[rows], k, mode, nprobe)
+        for row, i in enumerate(rows):
+            results[i] = analogy_results(analogies[i], sims[row], indices[row])
+    return results
+
+@app.post("/analogy")
+@inference
+def get_analogy(request: AnalogyRequest):
+    return {"results": run_analogies([request])[0]}
+
+@app.post("/analogy/batch")
+@inference
+def get_analogy_batch(request: AnalogyBatchRequest):
+    if any(a.model not in (None, request.model) for a in request.analogies):
+        raise HTTPException(status_code=400, detail="Set the model for the whole batch, not per analogy")
+    return {"results": run_analogies(request.analogies)}
+
+@app.post("/nearest-tokens")
+@inference
+def get_nearest_tokens(request: NearestTokensRequest):
+    """Most similar tokens (cosine) to each query token in W_E or W_U"""
+    model = active_model()
+    query_ids = list(request.token_ids)
+    for word in request.words:
+        ids = enc.encode(word)
+        if ids:
+            # Use the first token if multiple, as /analogy does
+            query_ids.append(ids[0])
+    if not query_ids:
+        raise HTTPException(status_code=400, detail="Provide at least one word or token ID")
+    if any(i < 0 or i >= model.vocab_size for i in query_ids):
+        raise HTTPException(status_code=400, detail="Token ID out of range")
+    
+    if request.space not in SPACES:
+        raise HTTPException(status_code=400, detail=f"Unknown space: {request.space}")
+    queries = SPACES[request.space](model).detach()[query_ids]
+    
+    # The query token itself is always its own nearest neighbour; fetch one extra
+    sims, indices = search_index(request.space, queries, request.top_k + 1, request.mode, request.nprobe)
+    
+    neighbours = []
+    for row, query_id in enumerate(query_ids):
+        matches = []
+        for score, idx in zip(sims[row].tolist(), indices[row].tolist()):
+            if idx < 0 or idx == query_id:
+                continue
+            matches.append({"token": token_strings[idx], "score": score, "id": idx})
+        neighbours.append({
+            "token": token_strings[query_id],
+            "id": query_id,
+            "neighbours": matches[:request.top_k]
+        })
+    
+    return {"results": neighbours}
 
 @app.post("/token-predictions")
+@inference
 def get_token_predictions(request: TextRequest):
     """Get predictions for each token position in the sequence"""
-    text = request.text
-    if not text:
-        raise HTTPException(status_code=400, detail="Text cannot be empty")
+    ids = encode_text(request.text)
+    result = stored("token_predictions", ids, {"top_k": request.top_k}, lambda: compute_token_predictions(
+        ids, run_forward(ids, SECTION_CAPTURES["token_predictions"]), request.top_k
+    ))
+    result["tokens"] = decode_tokens(ids)
+    return result
+
+def compute_token_predictions(ids, outputs, top_k):
+    logits = outputs["logits"]  # [B, T, vocab_size]
     
-    ids = enc.encode(text)
-    input_tensor = torch.tensor(ids).unsqueeze(0)
+    # Top-k predictions for every position in one batched softmax/topk
+    top_k_probs, top_k_indices, log_probs = top_k_predictions(logits[0], top_k)
     
-    with torch.no_grad():
-        logits = model(input_tensor)  # [B, T, vocab_size]
+    # Also get the actual token's probability at each position
+    actual_probs = log_probs.gather(1, torch.tensor(ids)[:, None]).squeeze(1).exp().tolist()
     
-    # For each position, get the top-k predictions
     token_predictions = []
-    
-    for pos in range(len(ids)):
-        pos_logits = logits[0, pos, :]
-        probs = F.softmax(pos_logits, dim=-1)
-        
-        # Get top-k
-        top_k_probs, top_k_indices = torch.topk(probs, request.top_k)
-        
-        predictions = []
-        for i in range(request.top_k):
-            token_id = top_k_indices[i].item()
-            token_str = enc.decode([token_id])
-            prob = top_k_probs[i].item()
-            predictions.append({"token": token_str, "prob": prob, "id": token_id})
-        
-        # Also get the actual token's probability
-        actual_token_id = ids[pos]
-        actual_prob = probs[actual_token_id].item()
-        
+    for pos, actual_token_id in enumerate(ids):
         token_predictions.append({
             "position": pos,
-            "actual_token": enc.decode([actual_token_id]),
+            "actual_token": token_strings[actual_token_id],
             "actual_token_id": actual_token_id,
-            "actual_prob": actual_prob,
-            "top_k": predictions
+            "actual_prob": actual_probs[pos],
+            "top_k": prediction_list(top_k_probs[pos], top_k_indices[pos])
         })
     
-    return {
-        "tokens": [enc.decode([i]) for i in ids],
-        "predictions": token_predictions
-    }
+    return {"predictions": token_predictions}
+
+class EigenvalueRequest(TextRequest):
+    singular_values: bool = False
 
 @app.post("/eigenvalues")
-def get_eigenvalues(request: TextRequest):
+@inference
+def get_eigenvalues(request: EigenvalueRequest):
     """Compute eigenvalues of attention patterns for each head"""
-    text = request.text
-    if not text:
-        raise HTTPException(status_code=400, detail="Text cannot be empty")
-    
-    ids = enc.encode(text)
-    input_tensor = torch.tensor(ids).unsqueeze(0)
-    
-    with torch.no_grad():
-        _, _, pattern, _, _, _ = model(input_tensor, return_all=True)
+    ids = encode_text(request.text)
+    result = stored("eigenvalues", ids, {"singular_values": True} if request.singular_values else {}, lambda: compute_eigenvalues(
+        ids, run_forward(ids, SECTION_CAPTURES["eigenvalues"]), request.singular_values
+    ))
+    result["tokens"] = decode_tokens(ids)
+    return result
+
+def compute_eigenvalues(ids, outputs, singular_values=False):
+    model = active_model()
+    pattern = outputs["pattern"]
     
     # pattern shape: [B, n_heads, T, T]
     pattern = pattern[0]  # Remove batch dim: [n_heads, T, T]
     
+    # Eigenvalue magnitudes for all heads at once, sorted descending: [n_heads, T]
+    eigenvalues_sorted = attention_spectra(pattern)
+    num_significant = (eigenvalues_sorted > 0.1).sum(-1).tolist()  # Count eigenvalues > 0.1
+    rank_estimate = (eigenvalues_sorted > 0.01).sum(-1).tolist()  # Effective rank
+    eigenvalues_sorted = eigenvalues_sorted.tolist()
+    
+    if singular_values:
+        # Batched SVD; singular values come back sorted descending
+        svdvals = torch.linalg.svdvals(pattern).tolist()
+    
     eigenvalue_data = []
     
     for h in range(model.n_heads):
-        attn_matrix = pattern[h]  # [T, T]
-        
-        # Compute eigenvalues
-        eigenvalues = torch.linalg.eigvals(attn_matrix)
-        
-        # Sort by magnitude
-        eigenvalues_sorted = torch.sort(torch.abs(eigenvalues), descending=True)[0]
-        
-        eigenvalue_data.append({
+        head = {
             "head": h,
-            "eigenvalues": eigenvalues_sorted.real.cpu().numpy().tolist(),
-            "num_significant": int((eigenvalues_sorted > 0.1).sum().item()),  # Count eigenvalues > 0.1
-            "rank_estimate": int((eigenvalues_sorted > 0.01).sum().item())  # Effective rank
-        })
+            "eigenvalues": eigenvalues_sorted[h],
+            "num_significant": num_significant[h],
+            "rank_estimate": rank_estimate[h]
+        }
+        if singular_values:
+            head["singular_values"] = svdvals[h]
+        eigenvalue_data.append(head)
     
-    return {
-        "eigenvalues": eigenvalue_data,
-        "tokens": [enc.decode([i]) for i in ids]
-    }
+    return {"eigenvalues": eigenvalue_data}
 
 @app.post("/induction-score")
+@inference
 def get_induction_score(request: TextRequest):
     """Detect in-context learning behaviors: copying and induction heads"""
-    text = request.text
-    if not text:
-        raise HTTPException(status_code=400, detail="Text cannot be empty")
-    
-    ids = enc.encode(text)
-    input_tensor = torch.tensor(ids).unsqueeze(0)
+    ids = encode_text(request.text)
+    tokens = decode_tokens(ids)
+    result = stored("induction", ids, {}, lambda: compute_induction_scores(ids, tokens, run_forward(ids, SECTION_CAPTURES["induction"])))
+    result["tokens"] = tokens
+    return result
+
+# Upper limit on prompts in one head sweep
+MAX_SWEEP_PROMPTS = int(os.environ.get("ATTENTION_LENS_MAX_SWEEP_PROMPTS", "1024"))
+
+class HeadSweepOptions(ModelRequest):
+    batch_size: int = 16
+    confidence: float = 0.95
+    per_prompt: bool = False  # also return every prompt's scores, [prompts, n_heads] per score
+
+class HeadSweepRequest(HeadSweepOptions):
+    texts: list[str] = []
+    token_ids: list[list[int]] = []
+
+class RepeatedSequenceRequest(HeadSweepOptions):
+    n_prompts: int = 100
+    length: int = 50  # random tokens before the sequence repeats
+    repeats: int = 2
+    seed: int = 0
+
+def run_head_sweep(sequences, options, http_request, **info):
+    model = active_model()
+    if not sequences:
+        raise HTTPException(status_code=400, detail="Provide at least one prompt")
+    if len(sequences) > MAX_SWEEP_PROMPTS:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_SWEEP_PROMPTS} prompts per sweep")
+    if not 1 <= options.batch_size <= 256:
+        raise HTTPException(status_code=400, detail="batch_size must be between 1 and 256")
+    if not 0 < options.confidence < 1:
+        raise HTTPException(status_code=400, detail="confidence must be between 0 and 1")
+    if any(not ids for ids in sequences):
+        raise HTTPException(status_code=400, detail="Prompts cannot be empty")
+    if any(len(ids) > model.context_len for ids in sequences):
+        raise HTTPException(status_code=400, detail=f"Prompts must be at most {model.context_len} tokens")
+    if any(i < 0 or i >= model.vocab_size for ids in sequences for i in ids):
+        raise HTTPException(status_code=400, detail="Token ID out of range")
     
-    with torch.no_grad():
-        _, _, pattern, _, _, _ = model(input_tensor, return_all=True)
+    with stage("forward"):
+        scores = sweep_scores(model, sequences, options.batch_size)
+    result = {
+        **info,
+        "prompts": len(sequences),
+        "tokens": sum(len(ids) for ids in sequences),
+        "confidence": options.confidence,
+        "heads": summarize_scores(scores, options.confidence)
+    }
+    if options.per_prompt:
+        result["per_prompt"] = {name: values.float() for name, values in scores.items()}
+    return tensor_response(http_request, result)
+
+@app.post("/induction-score/batch")
+@inference
+def get_induction_score_batch(request: HeadSweepRequest, http_request: Request):
+    """Head behavior scores over many prompts (texts and/or token ID arrays),
+    aggregated per head with confidence intervals"""
+    # Checked before tokenizing, so an oversized request is rejected cheaply
+    if len(request.texts) + len(request.token_ids) > MAX_SWEEP_PROMPTS:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_SWEEP_PROMPTS} prompts per sweep")
+    sequences = [enc.encode(text) for text in request.texts] + [list(ids) for ids in request.token_ids]
+    return run_head_sweep(sequences, request, http_request)
+
+@app.post("/induction-score/repeated")
+@inference
+def get_induction_score_repeated(request: RepeatedSequenceRequest, http_request: Request):
+    """The batch sweep on generated repeated random token sequences, the
+    standard test for induction heads"""
+    if request.length < 1 or request.repeats < 1 or request.n_prompts < 1:
+        raise HTTPException(status_code=400, detail="n_prompts, length and repeats must be positive")
+    if request.length * request.repeats > active_model().context_len:
+        raise HTTPException(status_code=400, detail=f"length * repeats must be at most {active_model().context_len}")
+    if request.n_prompts > MAX_SWEEP_PROMPTS:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_SWEEP_PROMPTS} prompts per sweep")
+    sequences = repeated_random_sequences(request.n_prompts, request.length, request.repeats,
+                                          active_model().vocab_size, request.seed)
+    return run_head_sweep(sequences, request, http_request, length=request.length, repeats=request.repeats, seed=request.seed)
+
+def compute_induction_scores(ids, tokens, outputs):
+    model = active_model()
+    pattern = outputs["pattern"]
     
-    # pattern shape: [B, n_heads, T, T]
-    pattern = pattern[0].cpu().numpy()  # [n_heads, T, T]
+    # pattern shape: [B, n_heads, T, T]; all heads are scored at once
+    scores = head_behavior_scores(pattern, torch.tensor(ids).unsqueeze(0))
+    pattern = pattern[0]  # [n_heads, T, T]
     
-    tokens = [enc.decode([i]) for i in ids]
+    # Detect copying behavior: high attention to previous identical tokens
+    copying_examples = first_examples(pattern, scores["copying_mask"][0])
+    # Detect induction behavior: attention to token after previous occurrence
+    induction_examples = first_examples(pattern, scores["induction_mask"][0])
     
     head_behaviors = []
     
     for h in range(model.n_heads):
-        attn = pattern[h]  # [T, T]
-        
-        # Detect copying behavior: high attention to previous identical tokens
-        copying_score = 0.0
-        copying_examples = []
-        
-        # Detect induction behavior: attention to token after previous occurrence
-        induction_score = 0.0
-        induction_examples = []
-        
-        # For each position
-        for i in range(len(ids)):
-            # Look for previous occurrences of the same token
-            for j in range(i):
-                if ids[j] == ids[i]:
-                    # Found a repeat! Check attention weight
-                    copying_score += attn[i, j]
-                    if attn[i, j] > 0.3:  # Significant attention
-                        copying_examples.append({
-                            "from_pos": j,
-                            "to_pos": i,
-                            "token": tokens[i],
-                            "attention": float(attn[i, j])
-                        })
-                    
-                    # Check for induction: does position i attend to j+1?
-                    if j + 1 < len(ids):
-                        induction_score += attn[i, j + 1]
-                        if attn[i, j + 1] > 0.3:
-                            induction_examples.append({
-                                "pattern_pos": j,
-                                "query_pos": i,
-                                "attend_to": j + 1,
-                                "pattern_token": tokens[j],
-                                "next_token": tokens[j + 1],
-                                "attention": float(attn[i, j + 1])
-                            })
-        
-        # Normalize scores
-        num_tokens = len(ids)
-        copying_score = copying_score / max(num_tokens, 1)
-        induction_score = induction_score / max(num_tokens, 1)
-        
-        # Detect diagonal attention (attending to self)
-        diagonal_score = np.mean([attn[i, i] for i in range(len(ids))])
-        
-        # Detect previous token attention
-        prev_token_score = 0.0
-        if len(ids) > 1:
-            prev_token_score = np.mean([attn[i, i-1] for i in range(1, len(ids))])
+        copying_score = scores["copying_score"][0, h].item()
+        induction_score = scores["induction_score"][0, h].item()
+        diagonal_score = scores["diagonal_score"][0, h].item()
+        prev_token_score = scores["prev_token_score"][0, h].item()
         
         head_behaviors.append({
             "head": h,
-            "copying_score": float(copying_score),
-            "induction_score": float(induction_score),
-            "diagonal_score": float(diagonal_score),
-            "prev_token_score": float(prev_token_score),
-            "copying_examples": copying_examples[:5],  # Top 5
-            "induction_examples": induction_examples[:5],
+            "copying_score": copying_score,
+            "induction_score": induction_score,
+            "diagonal_score": diagonal_score,
+            "prev_token_score": prev_token_score,
+            "copying_examples": [
+                {"from_pos": j, "to_pos": i, "token": tokens[i], "attention": a}
+                for i, j, a in copying_examples[h]
+            ],
+            "induction_examples": [
+                {
+                    "pattern_pos": j - 1,
+                    "query_pos": i,
+                    "attend_to": j,
+                    "pattern_token": tokens[j - 1],
+                    "next_token": tokens[j],
+                    "attention": a
+                }
+                for i, j, a in induction_examples[h]
+            ],
             "behavior_type": classify_head_behavior(copying_score, induction_score, diagonal_score, prev_token_score)
         })
     
-    return {
-        "behaviors": head_behaviors,
-        "tokens": tokens
-    }
-
-def classify_head_behavior(copying, induction, diagonal, prev_token):
-    """Classify the primary behavior of an attention head"""
-    scores = {
-        "copying": copying,
-        "induction": induction,
-        "diagonal": diagonal,
-        "prev_token": prev_token
-    }
-    
-    max_behavior = max(scores, key=scores.get)
-    max_score = scores[max_behavior]
-    
-    if max_score < 0.1:
-        return "diffuse"
-    elif max_behavior == "copying":
-        return "copying"
-    elif max_behavior == "induction":
-        return "induction"
-    elif max_behavior == "diagonal":
-        return "self-attention"
-    elif max_behavior == "prev_token":
-        return "previous-token"
-    else:
-        return "mixed"
+    return {"behaviors": head_behaviors}
 
 @app.post("/logit-lens")
+@inference
 def get_logit_lens(request: TextRequest):
     """Apply logit lens: show predictions at intermediate computation stages"""
-    text = request.text
-    if not text:
-        raise HTTPException(status_code=400, detail="Text cannot be empty")
-    
-    ids = enc.encode(text)
-    input_tensor = torch.tensor(ids).unsqueeze(0)
+    ids = encode_text(request.text)
+    result = stored("logit_lens", ids, {"top_k": request.top_k},
+                    lambda: compute_logit_lens(ids, run_forward(ids, SECTION_CAPTURES["logit_lens"]), request.top_k))
+    result["tokens"] = decode_tokens(ids)
+    return result
+
+def compute_logit_lens(ids, outputs, top_k):
+    model = active_model()
+    logits = outputs["logits"]
     
     with torch.no_grad():
-        # Get intermediate states
-        logits, _, _, _, z, hidden_state = model(input_tensor, return_all=True)
-        
-        # We have:
-        # - After embedding + positional: input to attention
-        # - After attention (z): attention output
-        # - After residual (hidden_state): final hidden state
-        # - After unembedding (logits): final logits
-        
-        # Let's compute predictions at different stages
-        # Stage 1: Direct from embeddings (before attention)
-        pos = torch.arange(len(ids))
-        embeddings = model.W_E(input_tensor) + model.W_pos(pos).unsqueeze(0)
-        logits_pre_attn = model.W_U(embeddings)
+        # Stage 1: Direct from embeddings (before attention), using the
+        # pre-attention residual captured in the forward pass
+        logits_pre_attn = model.W_U(outputs["embed"])
         
-        # Stage 2: After attention but before adding residual
-        # This would be: embeddings + attention_output
-        # But we already have hidden_state which is embeddings + attn_out
-        
-        # Stage 3: Final logits (already have this)
+        # Stage 2: Final logits (already have this)
     
-    # For each position, get top-k at each stage
-    lens_data = []
+    # Top-k at each stage for all positions at once
+    pre_top_k_probs, pre_top_k_indices, _ = top_k_predictions(logits_pre_attn[0], top_k)
+    final_top_k_probs, final_top_k_indices, _ = top_k_predictions(logits[0], top_k)
     
+    lens_data = []
     for pos in range(len(ids)):
-        # Pre-attention predictions
-        pre_probs = F.softmax(logits_pre_attn[0, pos, :], dim=-1)
-        pre_top_k_probs, pre_top_k_indices = torch.topk(pre_probs, request.top_k)
-        
-        # Final predictions
-        final_probs = F.softmax(logits[0, pos, :], dim=-1)
-        final_top_k_probs, final_top_k_indices = torch.topk(final_probs, request.top_k)
-        
         lens_data.append({
             "position": pos,
-            "token": enc.decode([ids[pos]]),
-            "pre_attention": [
-                {"token": enc.decode([idx.item()]), "prob": prob.item()}
-                for prob, idx in zip(pre_top_k_probs, pre_top_k_indices)
-            ],
-            "final": [
-                {"token": enc.decode([idx.item()]), "prob": prob.item()}
-                for prob, idx in zip(final_top_k_probs, final_top_k_indices)
-            ]
+            "token": token_strings[ids[pos]],
+            "pre_attention": prediction_list(pre_top_k_probs[pos], pre_top_k_indices[pos], with_ids=False),
+            "final": prediction_list(final_top_k_probs[pos], final_top_k_indices[pos], with_ids=False)
         })
     
+    return {"lens": lens_data}
+
+# Sections available from /analyze, mapped to the function computing each one
+# from a shared forward pass (capturing the union of their SECTION_CAPTURES)
+ANALYSIS_SECTIONS = {
+    "predictions": lambda ids, tokens, outputs, top_k: compute_predictions(ids, outputs, top_k),
+    "attention": lambda ids, tokens, outputs, top_k: compute_attention(ids, outputs),
+    "activations": lambda ids, tokens, outputs, top_k: compute_activations(ids, outputs),
+    "token_predictions": lambda ids, tokens, outputs, top_k: compute_token_predictions(ids, outputs, top_k),
+    "eigenvalues": lambda ids, tokens, outputs, top_k: compute_eigenvalues(ids, outputs),
+    "induction": lambda ids, tokens, outputs, top_k: compute_induction_scores(ids, tokens, outputs),
+    "logit_lens": lambda ids, tokens, outputs, top_k: compute_logit_lens(ids, outputs, top_k),
+}
+
+# Sections whose result depends on top_k
+TOP_K_SECTIONS = ("predictions", "token_predictions", "logit_lens")
+
+class AnalyzeRequest(ModelRequest):
+    text: str
+    top_k: int = 10
+    sections: list[str] = list(ANALYSIS_SECTIONS)
+
+@app.post("/analyze")
+@inference
+def analyze(request: AnalyzeRequest, http_request: Request):
+    """Compute several analyses of one prompt from a single forward pass.
+
+    Each requested section is returned under its own key with the same
+    payload as the matching standalone endpoint (minus the shared "tokens").
+    """
+    unknown = [name for name in request.sections if name not in ANALYSIS_SECTIONS]
+    if unknown:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Unknown sections: {', '.join(unknown)}. Available: {', '.join(ANALYSIS_SECTIONS)}"
+        )
+    
+    ids = encode_text(request.text)
+    tokens = decode_tokens(ids)
+    sections = list(dict.fromkeys(request.sections))
+    capture = set().union(*(SECTION_CAPTURES[name] for name in sections))
+    # Run the forward pass only if some section is not in the result store
+    outputs = functools.cache(lambda: run_forward(ids, capture))
+    
+    result = {"tokens": tokens}
+    for name in sections:
+        result[name] = stored(
+            name, ids, {"top_k": request.top_k} if name in TOP_K_SECTIONS else {},
+            lambda: ANALYSIS_SECTIONS[name](ids, tokens, outputs(), request.top_k)
+        )
+    return tensor_response(http_request, result)
+
+class CompareRequest(BaseModel):
+    text: str
+    model_a: str = DEFAULT_MODEL
+    model_b: str
+    top_k: int = 10
+
+@app.post("/compare")
+@inference
+def compare_models(request: CompareRequest, http_request: Request):
+    """Run one prompt through two checkpoints and return what changes from A to B.
+
+    ``attention_delta`` is pattern_B - pattern_A per head. ``heads`` summarizes
+    it, including the mean KL divergence of B's attention rows from A's.
+    ``predictions`` has the KL divergence of the next-token distributions at
+    every position, top-1 agreement, and for the last position both top-k lists
+    and the tokens whose probability moved the most.
+    """
+    models = {"a": select_model(request.model_a), "b": select_model(request.model_b)}
+    if models["a"].n_heads != models["b"].n_heads:
+        raise HTTPException(status_code=400, detail="Attention can only be compared between models with the same number of heads")
+    ids = encode_text(request.text)
+    outputs = {}
+    for key, selected in models.items():
+        # Each pass goes through the forward cache, keyed by checkpoint hash
+        with use_model(selected):
+            outputs[key] = run_forward(ids, ("pattern", "logits"))
+    
+    pattern_a, pattern_b = outputs["a"]["pattern"][0], outputs["b"]["pattern"][0]
+    delta = pattern_b - pattern_a  # [n_heads, T, T]
+    eps = 1e-10
+    # Masked (future) positions are 0 in both patterns and contribute nothing
+    attention_kl = (pattern_a * ((pattern_a + eps).log() - (pattern_b + eps).log())).sum(-1).mean(-1)
+    heads = [
+        {
+            "head": h,
+            "mean_abs_delta": delta[h].abs().mean().item(),
+            "max_abs_delta": delta[h].abs().max().item(),
+            "kl_divergence": attention_kl[h].item()
+        }
+        for h in range(delta.shape[0])
+    ]
+    
+    log_probs_a = F.log_softmax(outputs["a"]["logits"][0].float(), dim=-1)
+    log_probs_b = F.log_softmax(outputs["b"]["logits"][0].float(), dim=-1)
+    kl = (log_probs_a.exp() * (log_probs_a - log_probs_b)).sum(-1)
+    prob_delta = log_probs_b[-1].exp() - log_probs_a[-1].exp()
+    changed = prob_delta.abs().topk(request.top_k).indices.tolist()
+    predictions = {
+        "kl_divergence": kl.tolist(),
+        "top1_agreement": (log_probs_a.argmax(-1) == log_probs_b.argmax(-1)).float().mean().item(),
+        "a": prediction_list(*top_k_predictions(outputs["a"]["logits"][0, -1], request.top_k)[:2]),
+        "b": prediction_list(*top_k_predictions(outputs["b"]["logits"][0, -1], request.top_k)[:2]),
+        "largest_changes": [
+            {"token": token_strings[i], "id": i, "prob_a": log_probs_a[-1, i].exp().item(),
+             "prob_b": log_probs_b[-1, i].exp().item(), "delta": prob_delta[i].item()}
+            for i in changed
+        ]
+    }
+    
+    return tensor_response(http_request, {
+        "tokens": decode_tokens(ids),
+        "models": {key: {"name": name, "version": models[key].version}
+                   for key, name in (("a", request.model_a), ("b", request.model_b))},
+        "attention_delta": delta,
+        "heads": heads,
+        "predictions": predictions
+    })
+
+# Upper limit on the tokens of one /analyze-long text
+MAX_LONG_TOKENS = int(os.environ.get("ATTENTION_LENS_MAX_LONG_TOKENS", "32768"))
+
+class LongTextRequest(ModelRequest):
+    text: str
+    top_k: int = 5
+    stride: Optional[int] = None  # defaults to half the context length
+    stream: bool = True
+
+def analyze_window(ids, start, end, keep_from, outputs, top_k):
+    """Per-token predictions/losses for the positions a window contributes, plus
+    per-head statistics over the whole window"""
+    logits, pattern = outputs["logits"], outputs["pattern"]
+    window_ids = torch.tensor(ids[start:end])
+    kept = slice(keep_from, end - start)
+    
+    top_k_probs, top_k_indices, log_probs = top_k_predictions(logits[0, kept], top_k)  # [kept, vocab_size]
+    
+    # Loss at position p is the negative log-likelihood of the token at p + 1
+    positions = list(range(start + keep_from, end))
+    targets = torch.tensor([ids[p + 1] if p + 1 < len(ids) else 0 for p in positions])
+    losses = (-log_probs.gather(1, targets[:, None]).squeeze(1)).tolist()
+    
+    tokens = []
+    for row, p in enumerate(positions):
+        tokens.append({
+            "position": p,
+            "token": token_strings[ids[p]],
+            "loss": losses[row] if p + 1 < len(ids) else None,
+            "top_k": prediction_list(top_k_probs[row], top_k_indices[row])
+        })
+    
+    scores = head_behavior_scores(pattern, window_ids.unsqueeze(0))
+    entropy = attention_entropy(pattern)[0, :, kept].mean(-1)  # [n_heads]
+    heads = {
+        name: scores[name][0].tolist()
+        for name in ("copying_score", "induction_score", "diagonal_score", "prev_token_score")
+    }
+    heads["attention_entropy"] = entropy.tolist()
+    
+    return {"start": start, "end": end, "tokens": tokens, "heads": heads}
+
+def iter_long_analysis(ids, request):
+    """Yield one result per window as it completes, then a summary over the whole text"""
+    model = active_model()
+    n_scored = 0
+    total_loss = 0.0
+    head_sums = None
+    n_windows = 0
+    
+    for start, end, keep_from, outputs in iter_windows(model, ids, ("logits", "pattern"), stride=request.stride):
+        window = analyze_window(ids, start, end, keep_from, outputs, request.top_k)
+        window["window"] = n_windows
+        n_windows += 1
+        
+        losses = [t["loss"] for t in window["tokens"] if t["loss"] is not None]
+        n_scored += len(losses)
+        total_loss += sum(losses)
+        
+        # Head statistics are averaged over windows, weighted by the tokens each contributes
+        weight = end - start - keep_from
+        if head_sums is None:
+            head_sums = {name: [0.0] * model.n_heads for name in window["heads"]}
+        for name, values in window["heads"].items():
+            head_sums[name] = [acc + weight * v for acc, v in zip(head_sums[name], values)]
+        
+        yield window
+    
+    mean_loss = total_loss / n_scored if n_scored else None
+    heads = []
+    for h in range(model.n_heads):
+        stats = {name: values[h] / len(ids) for name, values in head_sums.items()}
+        stats["head"] = h
+        stats["behavior_type"] = classify_head_behavior(
+            stats["copying_score"], stats["induction_score"], stats["diagonal_score"], stats["prev_token_score"]
+        )
+        heads.append(stats)
+    
+    yield {
+        "done": True,
+        "num_tokens": len(ids),
+        "num_windows": n_windows,
+        "mean_loss": mean_loss,
+        "perplexity": math.exp(mean_loss) if mean_loss is not None else None,
+        "heads": heads
+    }
+
+@app.post("/analyze-long")
+@inference
+def analyze_long(request: LongTextRequest):
+    """Analyze texts of any length in overlapping context-length windows.
+
+    With ``stream`` (the default) the response is newline-delimited JSON: one
+    object per window as it completes, followed by a summary object with
+    ``"done": true``. Otherwise all windows are stitched into one response.
+    """
+    ids = encode_text(request.text)
+    if len(ids) > MAX_LONG_TOKENS:
+        raise HTTPException(status_code=400, detail=f"Text is {len(ids)} tokens; at most {MAX_LONG_TOKENS} are allowed")
+    if request.stride is not None and request.stride < 1:
+        raise HTTPException(status_code=400, detail="stride must be positive")
+    
+    if request.stream:
+        # Windows are computed on an executor worker as the response is sent,
+        # holding one executor slot until the stream ends
+        lines = (json.dumps(item) + "\n" for item in iter_long_analysis(ids, request))
+        return StreamingResponse(executor.stream(lines), media_type="application/x-ndjson")
+    
+    items = list(iter_long_analysis(ids, request))
+    summary = items.pop()
     return {
-        "lens": lens_data,
-        "tokens": [enc.decode([i]) for i in ids]
+        "tokens": [t for window in items for t in window["tokens"]],
+        "windows": [{"start": w["start"], "end": w["end"], "heads": w["heads"]} for w in items],
+        "summary": summary
     }
+
+# Incremental analysis for editors that re-send the text on every keystroke
+sessions = SessionStore(
+    max_sessions=int(os.environ.get("ATTENTION_LENS_MAX_SESSIONS", "256")),
+    ttl=float(os.environ.get("ATTENTION_LENS_SESSION_TTL", "1800")),
+)
+
+class SessionUpdateRequest(ModelRequest):
+    text: str
+    top_k: int = 10
+
+def get_session(session_id):
+    session = sessions.get(session_id)
+    if session is None:
+        raise HTTPException(status_code=404, detail="Unknown or expired session")
+    return session
+
+@app.post("/sessions")
+def create_session():
+    return {"session_id": sessions.create()}
+
+@app.get("/sessions")
+def get_session_stats():
+    return sessions.stats()
+
+@app.post("/sessions/{session_id}/update")
+@inference
+def update_session(session_id: str, request: SessionUpdateRequest, http_request: Request):
+    """Analyze the session's new text, computing only what changed since the last update.
+
+    The response is a diff: drop everything from position ``keep`` onwards,
+    then append the returned ``tokens``, their attention rows ([n_heads,
+    new tokens, length]; row i covers keys 0 .. keep + i) and their top-k
+    predictions. ``predictions`` are the next-token predictions for the
+    whole text.
+    """
+    model = active_model()
+    session = get_session(session_id)
+    ids = encode_text(request.text)
+    check_length(ids)
+    with session.lock, stage("forward"):
+        keep, outputs = session.update(model, ids)
+    
+    top_k_probs, top_k_indices, _ = top_k_predictions(outputs["logits"][0], request.top_k)
+    return tensor_response(http_request, {
+        "keep": keep,
+        "length": len(ids),
+        "tokens": decode_tokens(ids[keep:]),
+        "attention": outputs["pattern"][0],
+        "token_predictions": [prediction_list(p, i) for p, i in zip(top_k_probs, top_k_indices)],
+        "predictions": prediction_list(top_k_probs[-1], top_k_indices[-1]),
+    })
+
+@app.delete("/sessions/{session_id}")
+def delete_session(session_id: str):
+    if not sessions.delete(session_id):
+        raise HTTPException(status_code=404, detail="Unknown or expired session")
+    return {"deleted": session_id}
+
+# Corpus jobs may only read files under this directory; their results are
+# written to <corpus dir>/results/<job id>
+CORPUS_DIR = os.environ.get(
+    "ATTENTION_LENS_CORPUS_DIR", os.path.join(os.path.dirname(__file__), '..', 'corpora')
+)
+corpus_jobs = {}
+
+class CorpusJobRequest(BaseModel):
+    path: str  # relative to the corpus directory
+    batch_size: int = 16
+    max_tokens: Optional[int] = None
+
+def get_corpus_job(job_id):
+    job = corpus_jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Unknown corpus job")
+    return job
+
+@app.post("/corpus-jobs")
+def start_corpus_job(request: CorpusJobRequest):
+    """Start analyzing a corpus file in the background"""
+    require_model()
+    root = os.path.realpath(CORPUS_DIR)
+    path = os.path.realpath(os.path.join(root, request.path))
+    if not path.startswith(root + os.sep):
+        raise HTTPException(status_code=400, detail="Corpus path must be inside the corpus directory")
+    if not os.path.isfile(path):
+        raise HTTPException(status_code=404, detail=f"Corpus file not found: {request.path}")
+    if request.batch_size < 1:
+        raise HTTPException(status_code=400, detail="batch_size must be positive")
+    
+    job_id = uuid.uuid4().hex[:12]
+    job = CorpusJob(
+        model, enc, path, os.path.join(root, "results", job_id),
+        batch_size=request.batch_size, max_tokens=request.max_tokens
+    )
+    corpus_jobs[job_id] = job
+    threading.Thread(target=job.run, name=f"corpus-{job_id}", daemon=True).start()
+    return {"job_id": job_id, **job.info()}
+
+@app.get("/corpus-jobs")
+def list_corpus_jobs():
+    return {"jobs": {job_id: job.info() for job_id, job in corpus_jobs.items()}}
+
+@app.get("/corpus-jobs/{job_id}")
+def get_corpus_job_status(job_id: str):
+    return get_corpus_job(job_id).info()
+
+@app.delete("/corpus-jobs/{job_id}")
+def cancel_corpus_job(job_id: str):
+    job = get_corpus_job(job_id)
+    job.cancel()
+    return job.info()
+
+@app.get("/corpus-jobs/{job_id}/stream")
+def stream_corpus_job(job_id: str, interval: float = 1.0):
+    """Newline-delimited JSON progress updates until the job finishes"""
+    job = get_corpus_job(job_id)
+    
+    def updates():
+        while True:
+            info = job.info()
+            yield json.dumps(info) + "\n"
+            if info["status"] not in ("pending", "running"):
+                break
+            time.sleep(max(interval, 0.1))
+    
+    return StreamingResponse(updates(), media_type="application/x-ndjson")
@@ -0,0 +1,169 @@
+"""Per-request stage timings and Prometheus-style metrics.
+
+A ``RequestRecord`` is attached to each request through a context variable
+(which the inference executor carries over to its worker threads).
+Instrumented code wraps its stages in ``stage("forward")`` etc. and reports
+the tensors it produced with ``record_tensors``. When the request finishes,
+``Metrics.observe`` folds its record into histograms rendered in the
+Prometheus text format.
+"""
+import contextvars
+import math
+import threading
+import time
+from contextlib import contextmanager
+
+from cache import tensor_nbytes
+
+# Latency buckets in seconds, from sub-millisecond cache hits to long analyses
+DURATION_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = tuple(4 ** i * 1024 for i in range(10))  # 1 KiB .. 256 MiB
+
+_current = contextvars.ContextVar("attention_lens_request", default=None)
+
+
+class RequestRecord:
+    def __init__(self, profile: bool = False):
+        self.started = time.perf_counter()
+        self.stages = {}        # stage name -> seconds
+        self.tensor_bytes = {}  # activation name -> bytes
+        self.profile = profile
+        self.handler_done = None
+        self.trace_id = None
+        self._lock = threading.Lock()
+
+    def add_stage(self, name, seconds):
+        with self._lock:
+            self.stages[name] = self.stages.get(name, 0.0) + seconds
+
+
+def start_request(profile: bool = False):
+    """Attach a new record to the current context; returns (record, reset token)"""
+    record = RequestRecord(profile)
+    return record, _current.set(record)
+
+
+def end_request(token):
+    _current.reset(token)
+
+
+def current():
+    return _current.get()
+
+
+@contextmanager
+def stage(name):
+    """Time a block as stage ``name`` of the current request (no-op outside a request)"""
+    record = _current.get()
+    if record is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record.add_stage(name, time.perf_counter() - start)
+
+
+def record_tensors(tensors):
+    """Note the size of each named tensor in a dict produced for the current request"""
+    record = _current.get()
+    if record is None:
+        return
+    with record._lock:
+        for name, value in tensors.items():
+            record.tensor_bytes[name] = record.tensor_bytes.get(name, 0) + tensor_nbytes(value)
+
+
+def profiling():
+    """Whether the current request asked for a profiler trace"""
+    record = _current.get()
+    return record is not None and record.profile
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.count += 1
+        self.sum += value
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+
+
+def format_labels(labels):
+    return ",".join(f'{key}="{value}"' for key, value in labels)
+
+
+class Metrics:
+    """Request counters and histograms per route, rendered in the Prometheus text format"""
+
+    def __init__(self, prefix: str = "attention_lens"):
+        self.prefix = prefix
+        self._lock = threading.Lock()
+        self._counters = {}    # (name, labels) -> value
+        self._histograms = {}  # (name, labels) -> Histogram
+
+    def _histogram(self, name, labels, buckets):
+        key = (name, labels)
+        histogram = self._histograms.get(key)
+        if histogram is None:
+            histogram = self._histograms[key] = Histogram(buckets)
+        return histogram
+
+    def observe(self, route, method, status, record, total_seconds, response_bytes=None):
+        labels = (("route", route), ("method", method))
+        with self._lock:
+            key = ("requests_total", labels + (("status", str(status)),))
+            self._counters[key] = self._counters.get(key, 0) + 1
+            self._histogram("request_duration_seconds", labels, DURATION_BUCKETS).observe(total_seconds)
+            for name, seconds in record.stages.items():
+                self._histogram("stage_duration_seconds", labels + (("stage", name),), DURATION_BUCKETS).observe(seconds)
+            for name, nbytes in record.tensor_bytes.items():
+                self._histogram("tensor_bytes", labels + (("tensor", name),), SIZE_BUCKETS).observe(nbytes)
+            if response_bytes is not None:
+                self._histogram("response_bytes", labels, SIZE_BUCKETS).observe(response_bytes)
+
+    def render(self, gauges=None):
+        """Text exposition of all metrics, plus ``gauges`` ({name: value}) sampled by the caller"""
+        lines = []
+        with self._lock:
+            counter_names = sorted({name for name, _ in self._counters})
+            for name in counter_names:
+                lines.append(f"# TYPE {self.prefix}_{name} counter")
+                for (n, labels), value in sorted(self._counters.items()):
+                    if n == name:
+                        lines.append(f"{self.prefix}_{name}{{{format_labels(labels)}}} {value}")
+
+            histogram_names = sorted({name for name, _ in self._histograms})
+            for name in histogram_names:
+                metric = f"{self.prefix}_{name}"
+                lines.append(f"# TYPE {metric} histogram")
+                for (n, labels), histogram in sorted(self._histograms.items(), key=lambda item: item[0]):
+                    if n != name:
+                        continue
+                    for bound, count in zip(histogram.buckets, histogram.counts):
+                        bucket_labels = format_labels(labels + (("le", repr(float(bound))),))
+                        lines.append(f"{metric}_bucket{{{bucket_labels}}} {count}")
+                    lines.append(f'{metric}_bucket{{{format_labels(labels + (("le", "+Inf"),))}}} {histogram.count}')
+                    lines.append(f"{metric}_sum{{{format_labels(labels)}}} {histogram.sum}")
+                    lines.append(f"{metric}_count{{{format_labels(labels)}}} {histogram.count}")
+
+        for name, value in sorted((gauges or {}).items()):
+            if value is None or (isinstance(value, float) and math.isnan(value)):
+                continue
+            lines.append(f"# TYPE {self.prefix}_{name} gauge")
+            lines.append(f"{self.prefix}_{name} {float(value)}")
+        return "\n".join(lines) + "\n"
+
+
+def server_timing(record, total_seconds):
+    """``Server-Timing`` header value (durations in milliseconds)"""
+    parts = [f"{name};dur={seconds * 1000:.2f}" for name, seconds in record.stages.items()]
+    parts.append(f"total;dur={total_seconds * 1000:.2f}")
+    return ", ".join(parts)
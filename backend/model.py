@@ -3,8 +3,15 @@ import torch.nn as nn
 import torch.nn.functional as F
 import numpy as np
 import tiktoken
+import hashlib
+import json
 import os
 
+try:
+    from safetensors.torch import load_file as load_safetensors
+except ImportError:
+    load_safetensors = None
+
 class OneLayerTransformer(nn.Module):
     def __init__(self, vocab_size: int, d_model: int, n_heads: int, d_head: int, context_len: int):
         super().__init__()
@@ -23,7 +30,29 @@ class OneLayerTransformer(nn.Module):
         # Unembedding
         self.W_U = nn.Linear(self.d_model, self.vocab_size)
 
-    def forward(self, x: torch.Tensor, return_all: bool = False) -> torch.Tensor:
+    def forward(self, x: torch.Tensor, padding_mask: torch.Tensor = None, positions=None, capture=None):
+        # padding_mask: optional [B, T] bool, True for real tokens. Padded keys are
+        # excluded from attention so right-padded batches match unbatched results.
+        # positions: optional list of sequence positions (e.g. [-1]) to unembed.
+        # W_U dominates the cost of a pass, so when only some positions' logits
+        # are needed the rest are skipped; logits is then [B, len(positions), vocab_size].
+        # capture: optional collection of names from CAPTURES. The pass then
+        # returns a dict holding only those activations and stops as soon as
+        # all of them are computed (logits are only included if requested).
+        if capture is None:
+            wanted = {"logits"}
+        else:
+            wanted = set(capture)
+            unknown = wanted - CAPTURES.keys()
+            if unknown:
+                raise ValueError(f"Unknown activations: {', '.join(sorted(unknown))}")
+        captured = {}
+        def keep(name, value):
+            if name in wanted:
+                captured[name] = value
+            wanted.discard(name)
+            return not wanted
+
         device = x.device
         d_head, n_heads = self.d_head, self.n_heads
         B, T = x.shape
@@ -31,6 +60,8 @@ class OneLayerTransformer(nn.Module):
         x = self.W_E(x) + self.W_pos(pos)
         
         residual = x 
+        if keep("embed", residual):
+            return captured
         # B, T, C
         q = self.W_Q(x) # (B, T, n_heads * d_head)
         k = self.W_K(x) # 
@@ -41,44 +72,311 @@ class OneLayerTransformer(nn.Module):
         v = v.view(B, T, n_heads, d_head).transpose(1, 2)
         k = k.view(B, T, n_heads, d_head).transpose(1, 2)
                                 # B, T, n_heads, d_head -> B, T, n_heads, d_head
+        keep("q", q)
+        keep("k", k)
+        if keep("v", v):
+            return captured
         scores = torch.matmul(q, k.transpose(-2, -1)) / d_head ** 0.5 # [B, n_heads, T, d_head] @ [B, n_heads, d_head, T] = B, n_heads, T, T
         mask = torch.triu(torch.ones(T, T, device=device, dtype=torch.bool), diagonal=1)
         scores = scores.masked_fill(mask, float('-inf'))
+        if padding_mask is not None:
+            scores = scores.masked_fill(~padding_mask[:, None, None, :], float('-inf'))
         # 4. Softmax
         pattern = F.softmax(scores, dim=-1)
+        keep("scores", scores)
+        if keep("pattern", pattern):
+            return captured
 
         z = torch.matmul(pattern, v) # [B, n_heads, T, d_head]
+        if "head_out" in wanted:
+            # Each head's contribution to the residual stream: z_h @ W_O[:, h]^T
+            W_O = self.W_O.weight
+            if callable(W_O):  # dynamically quantized layer
+                W_O = W_O().dequantize()
+            keep("head_out", torch.einsum("bhtd,mhd->bhtm", z, W_O.view(self.d_model, n_heads, d_head)))
         z = z.transpose(1, 2).contiguous().view(B, T, -1)
+        if keep("z", z):
+            return captured
         attn_out = self.W_O(z)
+        if keep("attn_out", attn_out):
+            return captured
 
         hidden_state = attn_out + residual
+        if keep("hidden_state", hidden_state):
+            return captured
+        logits = self.W_U(hidden_state if positions is None else hidden_state[:, positions])
+        if capture is None:
+            return logits
+        keep("logits", logits)
+        return captured
+
+    def forward_incremental(self, x: torch.Tensor, past=None):
+        """Extend a sequence whose earlier positions' keys and values are cached.
+
+        x: [B, N] new token IDs at positions P .. P + N - 1, where P is the
+        length of ``past`` (a dict with "k" and "v" of shape
+        [B, n_heads, P, d_head], or None for an empty prefix). Attention is
+        causal, so earlier positions do not change when tokens are appended
+        and only the N new query rows are computed.
+
+        Returns a dict with "pattern" [B, n_heads, N, P + N] (the new rows),
+        "hidden_state" [B, N, d_model] and "logits" [B, N, vocab_size] for
+        the new positions, plus "k" and "v" covering all P + N positions to
+        pass as ``past`` next time.
+        """
+        d_head, n_heads = self.d_head, self.n_heads
+        B, N = x.shape
+        P = 0 if past is None else past["k"].shape[2]
+        if P + N > self.context_len:
+            raise ValueError(f"Sequence of {P + N} tokens exceeds the context length {self.context_len}")
+        pos = torch.arange(P, P + N, device=x.device)
+        x = self.W_E(x) + self.W_pos(pos)
+
+        q = self.W_Q(x).view(B, N, n_heads, d_head).transpose(1, 2)
+        k = self.W_K(x).view(B, N, n_heads, d_head).transpose(1, 2)
+        v = self.W_V(x).view(B, N, n_heads, d_head).transpose(1, 2)
+        if past is not None:
+            k = torch.cat([past["k"], k], dim=2)
+            v = torch.cat([past["v"], v], dim=2)
+
+        scores = torch.matmul(q, k.transpose(-2, -1)) / d_head ** 0.5  # [B, n_heads, N, P + N]
+        # New row i is position P + i and sees keys 0 .. P + i
+        mask = torch.triu(torch.ones(N, P + N, device=x.device, dtype=torch.bool), diagonal=P + 1)
+        pattern = F.softmax(scores.masked_fill(mask, float('-inf')), dim=-1)
+
+        z = torch.matmul(pattern, v).transpose(1, 2).contiguous().view(B, N, -1)
+        hidden_state = self.W_O(z) + x
         logits = self.W_U(hidden_state)
-        if return_all:
-            return logits, scores, pattern, v, z, hidden_state
-        return logits
+        return {"pattern": pattern, "hidden_state": hidden_state, "logits": logits, "k": k, "v": v}
 
-# Initialize model with default parameters from notebook
-def load_model(device='cpu'):
-    enc = tiktoken.get_encoding("r50k_base")
-    vocab_size = enc.n_vocab
-    d_model = 384
-    n_heads = 12
-    d_head = 32
-    context_len = 128
-    
-    model = OneLayerTransformer(vocab_size, d_model, n_heads, d_head, context_len)
-    
-    # Load weights
-    weights_path = os.path.join(os.path.dirname(__file__), '..', 'one_layer_transformer.pth')
-    if os.path.exists(weights_path):
+# Activations a forward pass can capture, with the dimensions that index
+# sequence positions (used to slice single sequences out of padded batches)
+CAPTURES = {
+    "embed": (1,),          # [B, T, d_model] token + positional embedding (pre-attention residual)
+    "q": (2,),              # [B, n_heads, T, d_head]
+    "k": (2,),              # [B, n_heads, T, d_head]
+    "v": (2,),              # [B, n_heads, T, d_head]
+    "scores": (2, 3),       # [B, n_heads, T, T] masked pre-softmax attention scores
+    "pattern": (2, 3),      # [B, n_heads, T, T]
+    "head_out": (2,),       # [B, n_heads, T, d_model] per-head attention output
+    "z": (1,),              # [B, T, n_heads * d_head]
+    "attn_out": (1,),       # [B, T, d_model]
+    "hidden_state": (1,),   # [B, T, d_model] residual stream after attention
+    "logits": (1,),         # [B, T, vocab_size]
+}
+
+def slice_sequence(captured, index, length):
+    """One sequence of a batched capture dict, without padding and with a batch dimension of 1"""
+    result = {}
+    for name, tensor in captured.items():
+        index_tuple = [slice(index, index + 1)] + [slice(None)] * (tensor.dim() - 1)
+        for dim in CAPTURES[name]:
+            index_tuple[dim] = slice(0, length)
+        result[name] = tensor[tuple(index_tuple)]
+    return result
+
+WEIGHTS_PATH = os.path.join(os.path.dirname(__file__), '..', 'one_layer_transformer.pth')
+SAFETENSORS_PATH = os.path.splitext(WEIGHTS_PATH)[0] + '.safetensors'
+
+# Dimensions of a randomly initialized model (the notebook's defaults), and
+# of a checkpoint's heads when neither its metadata nor its shapes tell
+DEFAULT_CONFIG = {"d_model": 384, "n_heads": 12, "d_head": 32, "context_len": 128}
+CONFIG_KEYS = ("vocab_size", "d_model", "n_heads", "d_head", "context_len")
+
+def checkpoint_hash(model: nn.Module) -> str:
+    """Content hash of the model's state dict, used to key caches of derived results"""
+    h = hashlib.sha256()
+    for name, tensor in sorted(model.state_dict().items()):
+        h.update(name.encode())
+        h.update(str(tuple(tensor.shape)).encode())
+        h.update(tensor.detach().cpu().contiguous().view(torch.uint8).numpy())
+    return h.hexdigest()
+
+def artifact_path(model: nn.Module, name: str) -> str:
+    """Path for a derived result (e.g. circuit spectra) stored next to the checkpoint.
+
+    The file name includes the checkpoint hash, so results computed from one
+    set of weights are never served for another. Returns None for randomly
+    initialized models, which have nothing worth persisting.
+    """
+    if model.weights_path is None:
+        return None
+    directory, filename = os.path.split(model.weights_path)
+    stem = os.path.splitext(filename)[0]
+    return os.path.join(directory, f"{stem}.{name}.{model.version[:16]}.pt")
+
+def find_weights():
+    """The checkpoint to load: a .safetensors file next to WEIGHTS_PATH is
+    preferred when the safetensors package is installed"""
+    if load_safetensors is not None and os.path.exists(SAFETENSORS_PATH):
+        return SAFETENSORS_PATH
+    if os.path.exists(WEIGHTS_PATH):
+        return WEIGHTS_PATH
+    return None
+
+def read_state_dict(path):
+    """Load a checkpoint memory-mapped: tensors are backed by the file, so pages
+    are read on first use and shared through the OS page cache"""
+    if path.endswith('.safetensors'):
+        return load_safetensors(path)
+    return torch.load(path, map_location='cpu', mmap=True, weights_only=True)
+
+def cached_checkpoint_hash(model: nn.Module, path: str) -> str:
+    """checkpoint_hash, remembered in a small sidecar file next to the checkpoint.
+
+    The sidecar is keyed by the file's size and modification time, so
+    restarting with unchanged weights skips hashing the whole state dict.
+    """
+    sidecar = path + '.sha256.json'
+    stat = os.stat(path)
+    key = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+    try:
+        with open(sidecar) as f:
+            cached = json.load(f)
+        if cached.get("size") == key["size"] and cached.get("mtime_ns") == key["mtime_ns"]:
+            return cached["hash"]
+    except (OSError, ValueError, KeyError):
+        pass
+
+    version = checkpoint_hash(model)
+    try:
+        with open(sidecar, 'w') as f:
+            json.dump({**key, "hash": version}, f)
+    except OSError as e:
+        print(f"Could not save checkpoint hash to {sidecar}: {e}")
+    return version
+
+def save_artifact(obj, path):
+    """torch.save through a temporary file, so a worker process never loads a
+    half-written artifact saved concurrently by another"""
+    tmp = f"{path}.{os.getpid()}.tmp"
+    torch.save(obj, tmp)
+    os.replace(tmp, path)
+
+def load_or_compute_artifact(path, compute, label):
+    """The artifact saved at ``path``, or ``compute()`` saved there for next time.
+
+    ``path`` may be None (nothing is persisted). Unreadable files are
+    recomputed and write failures only logged, naming the artifact ``label``.
+    """
+    if path is not None and os.path.exists(path):
+        try:
+            return torch.load(path, map_location='cpu')
+        except Exception as e:
+            print(f"Error loading {label} from {path}: {e}")
+
+    result = compute()
+    if path is not None:
+        try:
+            save_artifact(result, path)
+        except OSError as e:
+            print(f"Could not save {label} to {path}: {e}")
+    return result
+
+def config_from_state_dict(state_dict, known=None):
+    """Model dimensions from the shapes of a state dict, completing ``known``.
+
+    Only the product n_heads * d_head shows up in the shapes, so without
+    either in ``known`` heads of DEFAULT_CONFIG["d_head"] are assumed, with a
+    warning: a wrong split loads without error but gives wrong per-head results.
+    """
+    config = {k: int(v) for k, v in (known or {}).items() if k in CONFIG_KEYS}
+    vocab_size, d_model = state_dict["W_E.weight"].shape
+    config.setdefault("vocab_size", vocab_size)
+    config.setdefault("d_model", d_model)
+    config.setdefault("context_len", state_dict["W_pos.weight"].shape[0])
+    width = state_dict["W_Q.weight"].shape[0]
+    if "n_heads" in config:
+        config.setdefault("d_head", width // config["n_heads"])
+    else:
+        guessed = "d_head" not in config
+        config.setdefault("d_head", DEFAULT_CONFIG["d_head"] if width % DEFAULT_CONFIG["d_head"] == 0 else width)
+        config["n_heads"] = width // config["d_head"]
+        if guessed and width > 1:
+            print(f"Warning: checkpoint does not record n_heads or d_head; assuming {config['n_heads']} heads "
+                  f"of {config['d_head']} dimensions (any split of {width} fits its shapes). "
+                  f"Set n_heads in its .config.json if this is wrong")
+    if config["n_heads"] * config["d_head"] != width:
+        raise ValueError(f"n_heads * d_head = {config['n_heads']} * {config['d_head']} does not match W_Q's {width} rows")
+    return config
+
+def config_path(weights_path):
+    return os.path.splitext(weights_path)[0] + '.config.json'
+
+def checkpoint_config(path, state_dict):
+    """Dimensions of a checkpoint: from a ``<name>.config.json`` file next to
+    it or the safetensors metadata, with anything missing inferred from the
+    tensor shapes"""
+    known = {}
+    if os.path.exists(config_path(path)):
+        with open(config_path(path)) as f:
+            known = json.load(f)
+    elif path.endswith('.safetensors'):
+        from safetensors import safe_open
+        with safe_open(path, framework='pt') as f:
+            known = f.metadata() or {}
+    return config_from_state_dict(state_dict, known)
+
+def load_checkpoint(path):
+    """A model with the weights of the checkpoint at ``path`` (memory-mapped)"""
+    state_dict = read_state_dict(path)
+    config = checkpoint_config(path, state_dict)
+    # Parameters start on the meta device, so nothing is allocated or
+    # randomly initialized only to be overwritten by the checkpoint
+    with torch.device('meta'):
+        model = OneLayerTransformer(**config)
+    model.load_state_dict(state_dict, assign=True)
+    model.config = config
+    model.version = cached_checkpoint_hash(model, path)
+    model.weights_path = path
+    model.eval()
+    return model
+
+def build_model(vocab_size):
+    """The model with the checkpoint's weights, or randomly initialized if there is none"""
+    weights_path = find_weights()
+    if weights_path is not None:
         print(f"Loading weights from {weights_path}")
         try:
-            state_dict = torch.load(weights_path, map_location=device)
-            model.load_state_dict(state_dict)
+            return load_checkpoint(weights_path)
         except Exception as e:
             print(f"Error loading weights: {e}")
     else:
-        print(f"Weights file not found at {weights_path}, using random initialization")
+        print(f"Weights file not found at {WEIGHTS_PATH}, using random initialization")
+    
+    config = {"vocab_size": vocab_size, **DEFAULT_CONFIG}
+    model = OneLayerTransformer(**config)
+    model.config = config
+    model.version = checkpoint_hash(model)
+    model.weights_path = None
+    return model
+
+def load_model(device='cpu', shared_dir=None):
+    """Load the model and tokenizer.
+
+    The model's dimensions come from the checkpoint (see checkpoint_config),
+    or DEFAULT_CONFIG for a randomly initialized model. With ``shared_dir``
+    the weights are mapped from a file shared by all server processes (see
+    shared_weights.py) instead of loaded per process.
+    """
+    enc = tiktoken.get_encoding("r50k_base")
+    
+    if shared_dir:
+        from shared_weights import attach_shared_weights
+        def build():
+            built = build_model(enc.n_vocab)
+            metadata = {"version": built.version, "weights_path": built.weights_path, "config": built.config}
+            return built.state_dict(), metadata
+        state_dict, manifest = attach_shared_weights(shared_dir, find_weights(), build)
+        config = config_from_state_dict(state_dict, manifest.get("config"))
+        with torch.device('meta'):
+            model = OneLayerTransformer(**config)
+        model.load_state_dict(state_dict, assign=True)
+        model.config = config
+        model.version = manifest["version"]
+        model.weights_path = manifest["weights_path"]
+    else:
+        model = build_model(enc.n_vocab)
     
     model.to(device)
     model.eval()
@@ -0,0 +1,122 @@
+"""Reduced-precision variants of the model for latency-sensitive endpoints.
+
+    fp32  the loaded model itself
+    bf16  every weight cast to bfloat16
+    int8  the Linear layers (Q, K, V, O and the W_U unembedding) dynamically
+          quantized to int8; embeddings are shared with the fp32 model
+
+Variants are built on first use and cached per checkpoint. ``accuracy_report``
+measures what each one costs in accuracy against fp32 and what it saves in
+latency.
+"""
+import threading
+import time
+import warnings
+
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+
+from model import OneLayerTransformer
+
+PRECISIONS = ("fp32", "bf16", "int8")
+QUANTIZED_LAYERS = ("W_Q", "W_K", "W_V", "W_O", "W_U")
+
+_variants = {}
+_lock = threading.Lock()
+
+
+def make_variant(model, precision: str):
+    if precision == "fp32":
+        return model
+    if precision not in PRECISIONS:
+        raise ValueError(f"Unknown precision {precision!r}; expected one of {', '.join(PRECISIONS)}")
+
+    with torch.device("meta"):
+        variant = OneLayerTransformer(model.vocab_size, model.d_model, model.n_heads, model.d_head, model.context_len)
+    state_dict = model.state_dict()
+    if precision == "bf16":
+        state_dict = {name: tensor.to(torch.bfloat16) for name, tensor in state_dict.items()}
+    variant.load_state_dict(state_dict, assign=True)
+
+    if precision == "int8":
+        # Eager-mode dynamic quantization is deprecated upstream but remains the
+        # simplest int8 CPU path for plain Linear layers
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore")
+            for name in QUANTIZED_LAYERS:
+                quantized = torch.ao.quantization.quantize_dynamic(
+                    nn.Sequential(getattr(variant, name)), {nn.Linear}, dtype=torch.qint8
+                )
+                setattr(variant, name, quantized[0])
+
+    variant.eval()
+    variant.version = model.version
+    variant.weights_path = model.weights_path
+    variant.precision = precision
+    return variant
+
+
+def get_variant(model, precision: str):
+    """The model at ``precision``, built once per checkpoint"""
+    if precision == "fp32":
+        return model
+    with _lock:
+        key = (model.version, precision)
+        variant = _variants.get(key)
+        if variant is None:
+            variant = make_variant(model, precision)
+            _variants[key] = variant
+        return variant
+
+
+def forget_variants(version):
+    """Drop the reduced-precision copies of checkpoint ``version``"""
+    with _lock:
+        for key in [key for key in _variants if key[0] == version]:
+            del _variants[key]
+
+
+def time_forward(model, x, positions=None, repeats: int = 5):
+    """Median wall time (ms) of a forward pass"""
+    times = []
+    with torch.no_grad():
+        model(x, positions=positions)  # warm up
+        for _ in range(repeats):
+            start = time.perf_counter()
+            model(x, positions=positions)
+            times.append((time.perf_counter() - start) * 1000)
+    return sorted(times)[len(times) // 2]
+
+
+def accuracy_report(reference, variant, ids, repeats: int = 5):
+    """Compare ``variant`` against the fp32 ``reference`` on one sequence.
+
+    Reports the error of the logits (absolute error, KL divergence of the
+    next-token distributions, top-1 agreement per position) and of the
+    attention patterns, plus the median latency of a full forward pass and of
+    one that only unembeds the last position.
+    """
+    x = torch.tensor([ids])
+    with torch.no_grad():
+        ref = reference(x, capture=("logits", "pattern"))
+        out = variant(x, capture=("logits", "pattern"))
+    ref_logits, ref_pattern = ref["logits"].float(), ref["pattern"]
+    logits, pattern = out["logits"].float(), out["pattern"]
+    ref_log_probs = F.log_softmax(ref_logits, dim=-1)
+    log_probs = F.log_softmax(logits, dim=-1)
+    kl = (ref_log_probs.exp() * (ref_log_probs - log_probs)).sum(-1)
+    pattern_error = (pattern.float() - ref_pattern).abs()
+
+    return {
+        "logits_max_abs_error": (logits - ref_logits).abs().max().item(),
+        "logits_mean_abs_error": (logits - ref_logits).abs().mean().item(),
+        "kl_divergence_mean": kl.mean().item(),
+        "kl_divergence_max": kl.max().item(),
+        "top1_agreement": (logits.argmax(-1) == ref_logits.argmax(-1)).float().mean().item(),
+        "last_top1_match": logits[0, -1].argmax().item() == ref_logits[0, -1].argmax().item(),
+        "pattern_max_abs_error": pattern_error.max().item(),
+        "pattern_mean_abs_error": pattern_error.mean().item(),
+        "forward_ms": time_forward(variant, x, repeats=repeats),
+        "last_position_ms": time_forward(variant, x, positions=[-1], repeats=repeats),
+    }
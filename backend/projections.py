@@ -0,0 +1,95 @@
+import threading
+from collections import OrderedDict
+
+import torch
+
+from model import artifact_path, load_or_compute_artifact
+
+# Full-vocabulary projections per checkpoint hash
+_vocab_projections = {}
+# Projections fitted on specific token subsets, keyed by (checkpoint hash, ids)
+_subset_projections = OrderedDict()
+MAX_SUBSET_PROJECTIONS = 32
+_lock = threading.Lock()
+
+
+def _flip_signs(coords: torch.Tensor, components: torch.Tensor):
+    """Make the largest-magnitude weight of each component positive.
+
+    Singular vectors are only defined up to sign; this gives the same
+    deterministic orientation scikit-learn's PCA uses.
+    """
+    cols = components.abs().argmax(dim=1)
+    signs = torch.sign(components[torch.arange(components.shape[0]), cols])
+    signs[signs == 0] = 1
+    return coords * signs, components * signs[:, None]
+
+
+def fit_pca(vectors: torch.Tensor, n_components: int = 2, randomized: bool = False, seed: int = 0):
+    """PCA of the rows of ``vectors`` [N, d].
+
+    ``randomized`` uses ``torch.pca_lowrank`` (a few power iterations on a
+    random sketch), which is what makes full-vocabulary projections cheap;
+    otherwise an exact SVD is used. Returns a dict with ``mean`` [d],
+    ``components`` [n_components, d] and ``coords`` [N, n_components].
+    """
+    vectors = vectors.detach().float()
+    mean = vectors.mean(dim=0)
+    centered = vectors - mean
+    if randomized:
+        # Seeded so the projection is reproducible, without disturbing the global RNG
+        with torch.random.fork_rng():
+            torch.manual_seed(seed)
+            _, _, V = torch.pca_lowrank(centered, q=min(n_components + 8, *centered.shape), center=False, niter=4)
+        components = V[:, :n_components].T
+    else:
+        _, _, Vh = torch.linalg.svd(centered, full_matrices=False)
+        components = Vh[:n_components]
+    if components.shape[0] < n_components:
+        # Fewer points (or dimensions) than components: the rest are zero, so
+        # e.g. a single token still gets 2D coordinates (at the origin)
+        padding = components.new_zeros(n_components - components.shape[0], components.shape[1])
+        components = torch.cat([components, padding])
+    coords = centered @ components.T
+    coords, components = _flip_signs(coords, components)
+    return {"mean": mean, "components": components, "coords": coords}
+
+
+def get_vocab_projection(model):
+    """2D PCA of every token embedding, computed once per checkpoint and persisted"""
+    with _lock:
+        projection = _vocab_projections.get(model.version)
+        if projection is not None:
+            return projection
+
+        projection = load_or_compute_artifact(
+            artifact_path(model, "pca"), lambda: fit_pca(model.W_E.weight, randomized=True), "embedding projection"
+        )
+        _vocab_projections[model.version] = projection
+        return projection
+
+
+def get_subset_projection(model, ids):
+    """PCA fitted on just the given tokens' embeddings; recent subsets are cached"""
+    key = (model.version, tuple(ids))
+    with _lock:
+        projection = _subset_projections.get(key)
+        if projection is not None:
+            _subset_projections.move_to_end(key)
+            return projection
+
+    projection = fit_pca(model.W_E.weight[list(ids)])
+
+    with _lock:
+        _subset_projections[key] = projection
+        while len(_subset_projections) > MAX_SUBSET_PROJECTIONS:
+            _subset_projections.popitem(last=False)
+    return projection
+
+
+def forget_projections(version):
+    """Drop the in-memory projections of checkpoint ``version``"""
+    with _lock:
+        _vocab_projections.pop(version, None)
+        for key in [key for key in _subset_projections if key[0] == version]:
+            del _subset_projections[key]
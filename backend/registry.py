@@ -0,0 +1,154 @@
+"""Checkpoints the server can serve alongside (or instead of) its default model.
+
+Every ``.pth`` and ``.safetensors`` file in the checkpoint directory is
+available under its file name without the extension, and files added while
+the server runs are picked up on the next lookup. A checkpoint is loaded the
+first time a request selects it, with its dimensions read from its metadata
+or inferred from its shapes (``model.checkpoint_config``). Loaded models are
+kept least recently used first within a memory budget. Pinned models (the
+default one) are never evicted and do not count against the budget. When a
+model is unloaded, the ``on_unload`` hooks are called with its checkpoint
+hash so caches derived from it (circuit spectra, projections, indexes,
+reduced-precision copies) can be dropped too.
+"""
+import os
+import threading
+from collections import OrderedDict
+
+from cache import tensor_nbytes
+from model import load_checkpoint
+
+CHECKPOINT_EXTENSIONS = (".pth", ".pt", ".safetensors")
+
+
+def model_nbytes(model):
+    return tensor_nbytes(model.state_dict())
+
+
+class ModelRegistry:
+    def __init__(self, directory: str, max_bytes: int = 2 * 1024 * 1024 * 1024, vocab_size: int = None,
+                 on_unload=()):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.vocab_size = vocab_size  # checkpoints must match the tokenizer
+        self.on_unload = list(on_unload)  # called with the version of every unloaded model
+        self._pinned = {}              # name -> model
+        self._loaded = OrderedDict()   # name -> model, least recently used first
+        self._loading = {}             # name -> lock held while it loads
+        self._lock = threading.Lock()
+        self.loads = 0
+        self.evictions = 0
+
+    def pin(self, name, model):
+        with self._lock:
+            self._loaded.pop(name, None)
+            replaced = self._pinned.get(name)
+            self._pinned[name] = model
+        if replaced is not None and replaced is not model:
+            self._forget([replaced])
+
+    def checkpoints(self):
+        """Checkpoint files in the directory: name -> path"""
+        try:
+            files = sorted(os.listdir(self.directory))
+        except OSError:
+            return {}
+        found = {}
+        for filename in files:
+            stem, extension = os.path.splitext(filename)
+            # Skip derived artifacts saved next to checkpoints (name.kind.hash.pt)
+            if extension in CHECKPOINT_EXTENSIONS and "." not in stem:
+                found.setdefault(stem, os.path.join(self.directory, filename))
+        return found
+
+    def get(self, name):
+        """The model called ``name``, loading it if needed. Raises KeyError for
+        unknown names and ValueError for checkpoints that cannot be served."""
+        with self._lock:
+            if name in self._pinned:
+                return self._pinned[name]
+            if name in self._loaded:
+                self._loaded.move_to_end(name)
+                return self._loaded[name]
+            loading = self._loading.setdefault(name, threading.Lock())
+
+        # One thread loads a checkpoint while others asking for it wait
+        with loading:
+            with self._lock:
+                if name in self._loaded:
+                    return self._loaded[name]
+            path = self.checkpoints().get(name)
+            if path is None:
+                raise KeyError(name)
+            print(f"Loading checkpoint {name} from {path}")
+            try:
+                model = load_checkpoint(path)
+            except (OSError, RuntimeError, KeyError, ValueError) as e:
+                raise ValueError(f"Could not load checkpoint {name}: {e}")
+            if self.vocab_size is not None and model.vocab_size != self.vocab_size:
+                raise ValueError(
+                    f"Checkpoint {name} has a vocabulary of {model.vocab_size} tokens, "
+                    f"but the tokenizer has {self.vocab_size}"
+                )
+            with self._lock:
+                self._loaded[name] = model
+                self.loads += 1
+                evicted = self._evict(keep=name)
+            self._forget(evicted)
+        return model
+
+    def unload(self, name):
+        with self._lock:
+            model = self._loaded.pop(name, None)
+        if model is None:
+            return False
+        self._forget([model])
+        return True
+
+    def _evict(self, keep):
+        """Unload least recently used models until the rest fit; returns them"""
+        evicted = []
+        total = sum(model_nbytes(m) for m in self._loaded.values())
+        for name in list(self._loaded):
+            if total <= self.max_bytes:
+                break
+            if name == keep:
+                continue
+            evicted.append(self._loaded.pop(name))
+            total -= model_nbytes(evicted[-1])
+            self.evictions += 1
+        return evicted
+
+    def _forget(self, models):
+        # Run outside the registry lock: hooks take their caches' locks
+        with self._lock:
+            in_use = {m.version for m in (*self._loaded.values(), *self._pinned.values())}
+        for version in {m.version for m in models} - in_use:
+            for hook in self.on_unload:
+                hook(version)
+
+    def describe(self):
+        """Every available model: name, path, whether it is loaded, and the
+        dimensions and checkpoint hash of loaded ones"""
+        with self._lock:
+            loaded = {**self._loaded, **self._pinned}
+        models = []
+        paths = self.checkpoints()
+        for name in dict.fromkeys([*self._pinned, *paths]):
+            model = loaded.get(name)
+            entry = {"name": name, "path": paths.get(name) or getattr(model, "weights_path", None),
+                     "loaded": model is not None, "pinned": name in self._pinned}
+            if model is not None:
+                entry.update(version=model.version, config=model.config, bytes=model_nbytes(model))
+            models.append(entry)
+        return models
+
+    def stats(self):
+        with self._lock:
+            return {
+                "loaded": len(self._loaded),
+                "bytes": sum(model_nbytes(m) for m in self._loaded.values()),
+                "max_bytes": self.max_bytes,
+                "loads": self.loads,
+                "evictions": self.evictions,
+            }
@@ -0,0 +1,230 @@
+"""Persistent, content-addressed store of analysis results.
+
+Results are keyed by a hash of the analysis name, the checkpoint hash, the
+token IDs and the analysis parameters, so an entry can only ever be served
+for exactly the computation that produced it. Entries are kept in a SQLite
+database in the binary tensor format (``tensor_format.py``), survive server
+restarts and are shared by all worker processes. When the store grows past
+its size limit, the least recently read entries are evicted.
+
+Stores can be exported to a standalone database file and imported into
+another server's store, to share precomputed analyses:
+
+    python result_store.py export shared.sqlite3 [--store results.sqlite3] [--model-version HASH]
+    python result_store.py import shared.sqlite3 [--store results.sqlite3]
+    python result_store.py stats [--store results.sqlite3]
+"""
+import argparse
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+import numpy as np
+import torch
+
+from tensor_format import encode_payload, decode_payload
+
+# Part of every key: bump when the layout of stored results changes so old
+# entries are no longer served
+STORE_VERSION = 1
+
+DEFAULT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "results.sqlite3")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS results (
+    key TEXT PRIMARY KEY,
+    analysis TEXT NOT NULL,
+    model_version TEXT NOT NULL,
+    n_tokens INTEGER NOT NULL,
+    payload BLOB NOT NULL,
+    size INTEGER NOT NULL,
+    created REAL NOT NULL,
+    last_used REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS results_last_used ON results (last_used);
+-- Running total of payload sizes, kept by triggers so writes never scan the
+-- table (and every process sharing the database sees the same total)
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value INTEGER NOT NULL);
+INSERT INTO meta (key, value)
+    SELECT 'total_size', (SELECT COALESCE(SUM(size), 0) FROM results)
+    WHERE NOT EXISTS (SELECT 1 FROM meta WHERE key = 'total_size');
+CREATE TRIGGER IF NOT EXISTS results_insert AFTER INSERT ON results BEGIN
+    UPDATE meta SET value = value + NEW.size WHERE key = 'total_size';
+END;
+CREATE TRIGGER IF NOT EXISTS results_delete AFTER DELETE ON results BEGIN
+    UPDATE meta SET value = value - OLD.size WHERE key = 'total_size';
+END;
+"""
+COLUMNS = "key, analysis, model_version, n_tokens, payload, size, created, last_used"
+
+
+def result_key(analysis, model_version, ids, params=None):
+    """Content address of one analysis of one token sequence"""
+    description = json.dumps(
+        [STORE_VERSION, analysis, model_version, list(ids), params or {}],
+        sort_keys=True, separators=(",", ":"),
+    )
+    return hashlib.sha256(description.encode()).hexdigest()
+
+
+def to_torch(value):
+    """Decoded payload with numpy arrays turned back into (writable) tensors"""
+    if isinstance(value, np.ndarray):
+        return torch.from_numpy(value.copy())
+    if isinstance(value, dict):
+        return {k: to_torch(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [to_torch(v) for v in value]
+    return value
+
+
+def connect(path):
+    connection = sqlite3.connect(path, timeout=30, isolation_level=None, check_same_thread=False)
+    connection.execute("PRAGMA journal_mode=WAL")
+    # Rows replaced by INSERT OR REPLACE only fire the delete trigger with this on
+    connection.execute("PRAGMA recursive_triggers=ON")
+    connection.executescript(SCHEMA)
+    return connection
+
+
+class ResultStore:
+    """SQLite-backed analysis results, bounded by total payload size"""
+
+    def __init__(self, path: str = DEFAULT_PATH, max_bytes: int = 1024 * 1024 * 1024):
+        self.path = path
+        self.max_bytes = max_bytes
+        self._connection = connect(path)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        """The stored payload for ``key`` (tensors as torch tensors), or None"""
+        with self._lock:
+            row = self._connection.execute("SELECT payload FROM results WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self._connection.execute("UPDATE results SET last_used = ? WHERE key = ?", (time.time(), key))
+            self.hits += 1
+        return to_torch(decode_payload(row[0]))
+
+    def put(self, key, analysis, model_version, n_tokens, payload):
+        blob = encode_payload(payload, "float32")
+        if len(blob) > self.max_bytes:
+            return
+        now = time.time()
+        with self._lock:
+            self._connection.execute(
+                f"INSERT OR REPLACE INTO results ({COLUMNS}) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (key, analysis, model_version, n_tokens, blob, len(blob), now, now),
+            )
+            self._evict()
+
+    def _total_size(self):
+        return self._connection.execute("SELECT value FROM meta WHERE key = 'total_size'").fetchone()[0]
+
+    def _evict(self):
+        total = self._total_size()
+        if total <= self.max_bytes:
+            return
+        # Oldest reads first, until the total fits
+        excess = total - self.max_bytes
+        freed = 0
+        victims = []
+        for key, size in self._connection.execute("SELECT key, size FROM results ORDER BY last_used"):
+            victims.append((key,))
+            freed += size
+            if freed >= excess:
+                break
+        self._connection.executemany("DELETE FROM results WHERE key = ?", victims)
+        self.evictions += len(victims)
+
+    def export(self, path, model_version=None):
+        """Copy entries (only those of ``model_version`` if given) into a new
+        database at ``path``; returns the number of entries copied"""
+        if os.path.exists(path):
+            os.remove(path)
+        connect(path).close()
+        where, args = ("WHERE model_version = ?", (model_version,)) if model_version else ("", ())
+        with self._lock:
+            self._connection.execute("ATTACH DATABASE ? AS export", (path,))
+            try:
+                cursor = self._connection.execute(
+                    f"INSERT INTO export.results ({COLUMNS}) SELECT {COLUMNS} FROM results {where}", args
+                )
+                return cursor.rowcount
+            finally:
+                self._connection.execute("DETACH DATABASE export")
+
+    def import_from(self, path):
+        """Add the entries of an exported database that are not already stored;
+        returns the number of entries added"""
+        with self._lock:
+            self._connection.execute("ATTACH DATABASE ? AS import", (path,))
+            try:
+                tables = self._connection.execute(
+                    "SELECT name FROM import.sqlite_master WHERE type = 'table' AND name = 'results'"
+                ).fetchall()
+                if not tables:
+                    raise ValueError("Not an exported result store")
+                cursor = self._connection.execute(
+                    f"INSERT OR IGNORE INTO results ({COLUMNS}) SELECT {COLUMNS} FROM import.results"
+                )
+                added = cursor.rowcount
+            finally:
+                self._connection.execute("DETACH DATABASE import")
+            self._evict()
+        return added
+
+    def clear(self):
+        with self._lock:
+            self._connection.execute("DELETE FROM results")
+
+    def stats(self):
+        with self._lock:
+            entries = self._connection.execute("SELECT COUNT(*) FROM results").fetchone()[0]
+            size = self._total_size()
+            by_analysis = dict(self._connection.execute(
+                "SELECT analysis, COUNT(*) FROM results GROUP BY analysis"
+            ).fetchall())
+            lookups = self.hits + self.misses
+            return {
+                "path": os.path.abspath(self.path),
+                "entries": entries,
+                "bytes": size,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "entries_by_analysis": by_analysis,
+            }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export, import or inspect a result store")
+    parser.add_argument("command", choices=("export", "import", "stats"))
+    parser.add_argument("file", nargs="?", help="Exported database to write or read")
+    parser.add_argument("--store", default=os.environ.get("ATTENTION_LENS_RESULT_STORE") or DEFAULT_PATH)
+    parser.add_argument("--model-version", help="Only export results of this checkpoint hash")
+    args = parser.parse_args()
+
+    store = ResultStore(args.store, max_bytes=int(os.environ.get("ATTENTION_LENS_RESULT_STORE_MB", "1024")) * 1024 * 1024)
+    if args.command == "stats":
+        print(json.dumps(store.stats(), indent=2))
+        return
+    if not args.file:
+        parser.error(f"{args.command} needs a file")
+    if args.command == "export":
+        print(f"Exported {store.export(args.file, args.model_version)} results to {args.file}")
+    else:
+        print(f"Imported {store.import_from(args.file)} new results from {args.file}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+import torch
+
+
+def common_prefix(a, b):
+    """Number of leading items ``a`` and ``b`` share"""
+    n = min(len(a), len(b))
+    i = 0
+    while i < n and a[i] == b[i]:
+        i += 1
+    return i
+
+
+class Session:
+    """Token IDs and cached keys/values of the last text analyzed in one editor session"""
+
+    def __init__(self):
+        self.ids = []
+        self.past = None
+        self.version = None
+        self.lock = threading.Lock()
+        self.updates = 0
+        self.tokens_computed = 0
+
+    def update(self, model, ids):
+        """Bring the session up to ``ids``, computing only positions that changed.
+
+        The longest prefix shared with the previous IDs is kept, and the keys
+        and values past it are dropped. The remaining tokens are run
+        incrementally. At least the last token is always recomputed, so there
+        are fresh logits for it even when text was only deleted. Returns
+        ``(keep, outputs)``: the number of unchanged leading positions, and the
+        ``OneLayerTransformer.forward_incremental`` outputs from ``keep`` onwards.
+        """
+        if self.version != model.version:
+            self.ids, self.past, self.version = [], None, model.version
+        keep = min(common_prefix(self.ids, ids), len(ids) - 1)
+        past = None
+        if keep > 0:
+            past = {name: t[:, :, :keep] for name, t in self.past.items()}
+
+        with torch.no_grad():
+            outputs = model.forward_incremental(torch.tensor([ids[keep:]]), past)
+
+        self.ids = list(ids)
+        self.past = {"k": outputs["k"], "v": outputs["v"]}
+        self.updates += 1
+        self.tokens_computed += len(ids) - keep
+        return keep, outputs
+
+
+class SessionStore:
+    """Live incremental-analysis sessions, evicted least recently used first and after ``ttl`` seconds idle"""
+
+    def __init__(self, max_sessions: int = 256, ttl: float = 1800.0):
+        self.max_sessions = max_sessions
+        self.ttl = ttl
+        self._sessions = OrderedDict()  # session id -> (last used, Session)
+        self._lock = threading.Lock()
+        self.evictions = 0
+
+    def create(self):
+        session_id = uuid.uuid4().hex
+        with self._lock:
+            self._sessions[session_id] = (time.monotonic(), Session())
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+                self.evictions += 1
+        return session_id
+
+    def get(self, session_id):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._sessions.get(session_id)
+            if entry is None:
+                return None
+            if now - entry[0] > self.ttl:
+                del self._sessions[session_id]
+                self.evictions += 1
+                return None
+            self._sessions[session_id] = (now, entry[1])
+            self._sessions.move_to_end(session_id)
+            return entry[1]
+
+    def delete(self, session_id):
+        with self._lock:
+            return self._sessions.pop(session_id, None) is not None
+
+    def stats(self):
+        with self._lock:
+            sessions = [session for _, session in self._sessions.values()]
+            return {
+                "sessions": len(sessions),
+                "max_sessions": self.max_sessions,
+                "ttl_seconds": self.ttl,
+                "evictions": self.evictions,
+                "updates": sum(s.updates for s in sessions),
+                "tokens_computed": sum(s.tokens_computed for s in sessions),
+            }
@@ -0,0 +1,106 @@
+"""Model weights in one flat file that several server processes map.
+
+Running ``uvicorn main:app --workers N`` would otherwise give every worker
+its own copy of the weights. With a shared directory configured, the first
+process to start writes the state dict to ``weights.bin`` (64-byte aligned
+raw tensors) plus a ``manifest.json`` of names, dtypes, shapes and offsets.
+Every process then maps that file copy-on-write, so all workers read the
+same physical pages. Put the directory on a tmpfs such as ``/dev/shm`` to
+keep the segment in memory.
+
+The manifest records which checkpoint the file was built from (path, size
+and modification time), so replacing the weights rebuilds it on the next
+start. A randomly initialized model is built once and shared as well, so
+all workers serve the same weights.
+"""
+import fcntl
+import json
+import os
+
+import numpy as np
+import torch
+
+ALIGN = 64
+
+
+def source_key(weights_path):
+    """Identifies the checkpoint a shared file was built from"""
+    if weights_path is None:
+        return {"path": None}
+    stat = os.stat(weights_path)
+    return {"path": os.path.abspath(weights_path), "size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+
+def read_manifest(directory):
+    try:
+        with open(os.path.join(directory, "manifest.json")) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def write_shared(directory, state_dict, metadata):
+    """Write ``state_dict`` as one aligned flat file and its manifest (atomically)"""
+    tensors = {}
+    offset = 0
+    tmp = os.path.join(directory, "weights.bin.tmp")
+    with open(tmp, "wb") as f:
+        for name, tensor in state_dict.items():
+            data = tensor.detach().cpu().contiguous()
+            offset = -(-offset // ALIGN) * ALIGN
+            f.seek(offset)
+            f.write(data.view(torch.uint8).numpy().data)
+            nbytes = data.numel() * data.element_size()
+            tensors[name] = {
+                "dtype": str(data.dtype).removeprefix("torch."),
+                "shape": list(data.shape),
+                "offset": offset,
+                "nbytes": nbytes,
+            }
+            offset += nbytes
+    os.replace(tmp, os.path.join(directory, "weights.bin"))
+
+    tmp = os.path.join(directory, "manifest.json.tmp")
+    with open(tmp, "w") as f:
+        json.dump({"tensors": tensors, **metadata}, f, indent=2)
+    os.replace(tmp, os.path.join(directory, "manifest.json"))
+
+
+def read_shared(directory):
+    """Map the shared weights. Returns ``(state_dict, manifest)``.
+
+    Tensors are views into one copy-on-write mapping of ``weights.bin``:
+    reading them shares pages with every other process, and an accidental
+    in-place write only copies the touched page instead of corrupting the
+    file for the others.
+    """
+    manifest = read_manifest(directory)
+    buffer = np.memmap(os.path.join(directory, "weights.bin"), dtype=np.uint8, mode="c")
+    state_dict = {}
+    for name, entry in manifest["tensors"].items():
+        raw = torch.from_numpy(buffer[entry["offset"]:entry["offset"] + entry["nbytes"]])
+        state_dict[name] = raw.view(getattr(torch, entry["dtype"])).view(entry["shape"])
+    return state_dict, manifest
+
+
+def attach_shared_weights(directory, weights_path, build):
+    """Map the shared weights in ``directory``, writing them first if needed.
+
+    If the file is missing or was built from a different checkpoint,
+    ``build()`` is called for ``(state_dict, metadata)`` and both are written.
+    A lock file makes concurrently starting workers wait for the first one
+    instead of all building it. Returns ``(state_dict, manifest)``.
+    """
+    os.makedirs(directory, exist_ok=True)
+    key = source_key(weights_path)
+    with open(os.path.join(directory, "lock"), "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            manifest = read_manifest(directory)
+            if manifest is None or manifest.get("source") != key:
+                print(f"Writing shared weights to {directory}")
+                state_dict, metadata = build()
+                write_shared(directory, state_dict, {"source": key, **metadata})
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+    return read_shared(directory)
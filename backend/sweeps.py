@@ -0,0 +1,79 @@
+"""Head-behavior statistics over many prompts at once.
+
+Classifying heads from a single prompt is noisy. A sweep scores every head
+on a set of prompts (given, or generated repeated random sequences), running
+them through the model in right-padded batches, and reports each score's
+mean across prompts with a confidence interval.
+"""
+import math
+import statistics
+
+import torch
+
+from analysis import attention_entropy, classify_head_behavior, head_behavior_scores
+
+SCORES = ("copying_score", "induction_score", "diagonal_score", "prev_token_score", "attention_entropy")
+
+
+def repeated_random_sequences(count: int, length: int, repeats: int, vocab_size: int, seed: int = 0):
+    """``count`` sequences of ``length`` uniformly random tokens, each repeated
+    ``repeats`` times. Random tokens can only be predicted from their earlier
+    occurrence, which isolates induction heads."""
+    generator = torch.Generator().manual_seed(seed)
+    tokens = torch.randint(0, vocab_size, (count, length), generator=generator)
+    return tokens.repeat(1, repeats).tolist()
+
+
+def sweep_scores(model, sequences, batch_size: int = 16, pad_id: int = 0):
+    """Scores of every head on every sequence: {name: [len(sequences), n_heads]}.
+
+    Sequences are sorted by length before batching so each batch pads as
+    little as possible. Padded keys are masked out of attention and padded
+    positions out of the scores, so the result matches one pass per sequence.
+    """
+    order = sorted(range(len(sequences)), key=lambda i: len(sequences[i]))
+    scores = {name: torch.zeros(len(sequences), model.n_heads, dtype=torch.float64) for name in SCORES}
+    for start in range(0, len(order), batch_size):
+        batch = order[start:start + batch_size]
+        lengths = torch.tensor([len(sequences[i]) for i in batch])
+        T = int(lengths.max())
+        ids = torch.full((len(batch), T), pad_id, dtype=torch.long)
+        for row, i in enumerate(batch):
+            ids[row, :lengths[row]] = torch.tensor(sequences[i])
+        padding_mask = torch.arange(T)[None, :] < lengths[:, None]
+
+        with torch.no_grad():
+            pattern = model(ids, padding_mask=padding_mask, capture=("pattern",))["pattern"]
+        behavior = head_behavior_scores(pattern, ids, lengths)
+        index = torch.tensor(batch)
+        for name in SCORES[:-1]:
+            scores[name][index] = behavior[name]
+        # Mean entropy over each sequence's query positions
+        scores["attention_entropy"][index] = attention_entropy(pattern, lengths).sum(-1) / lengths[:, None]
+    return scores
+
+
+def summarize_scores(scores, confidence: float = 0.95):
+    """Per-head mean, standard deviation and a normal-approximation confidence
+    interval of each score across prompts, plus the behavior the mean scores
+    indicate (see analysis.classify_head_behavior)"""
+    z = statistics.NormalDist().inv_cdf(0.5 + confidence / 2)
+    n, n_heads = scores[SCORES[0]].shape
+    summary = {}
+    for name, values in scores.items():
+        mean = values.mean(0)
+        std = values.std(0) if n > 1 else torch.zeros(n_heads, dtype=values.dtype)
+        half_width = z * std / math.sqrt(n)
+        summary[name] = (mean.tolist(), std.tolist(), (mean - half_width).tolist(), (mean + half_width).tolist())
+
+    heads = []
+    for h in range(n_heads):
+        head = {"head": h}
+        for name, (mean, std, low, high) in summary.items():
+            head[name] = {"mean": mean[h], "std": std[h], "ci_low": low[h], "ci_high": high[h]}
+        head["behavior"] = classify_head_behavior(
+            summary["copying_score"][0][h], summary["induction_score"][0][h],
+            summary["diagonal_score"][0][h], summary["prev_token_score"][0][h]
+        )
+        heads.append(head)
+    return heads
@@ -0,0 +1,143 @@
+"""Compact binary encoding for responses that carry large float tensors.
+
+Layout (all integers little-endian):
+
+    4 bytes   magic b"ALT1"
+    4 bytes   uint32 header length in bytes
+    n bytes   UTF-8 JSON header, space-padded to a multiple of 8 bytes
+    ...       raw tensor buffers, each starting at an 8-byte aligned offset
+
+The header is ``{"data": ..., "tensors": [...]}`` where ``data`` is the
+response payload with every tensor replaced by ``{"$tensor": index}`` and
+each ``tensors`` entry is ``{"dtype", "shape", "offset", "nbytes"}``, with
+offsets relative to the start of the buffer section. Aligned offsets let
+clients view the buffers directly as typed arrays without copying.
+"""
+import json
+import struct
+
+import numpy as np
+import torch
+
+MEDIA_TYPE = "application/x-attention-lens-tensors"
+MAGIC = b"ALT1"
+SUPPORTED_DTYPES = ("float32", "float16")
+
+
+def _align(n, alignment=8):
+    return (n + alignment - 1) // alignment * alignment
+
+
+def negotiate(accept_header):
+    """Return the tensor dtype requested through the Accept header, or None for JSON.
+
+    Clients opt in with ``Accept: application/x-attention-lens-tensors`` and
+    can add ``; dtype=float16`` to halve the payload again.
+    """
+    if not accept_header:
+        return None
+    for media_range in accept_header.split(","):
+        parts = [p.strip() for p in media_range.split(";")]
+        if parts[0].lower() != MEDIA_TYPE:
+            continue
+        dtype = "float32"
+        for param in parts[1:]:
+            key, _, value = param.partition("=")
+            if key.strip().lower() == "dtype" and value.strip() in SUPPORTED_DTYPES:
+                dtype = value.strip()
+        return dtype
+    return None
+
+
+def encode_payload(payload, dtype="float32"):
+    """Serialize a payload containing torch tensors / numpy arrays to bytes.
+
+    Floating-point tensors are cast to ``dtype``; integer and bool tensors
+    keep their own type.
+    """
+    arrays = []
+
+    def replace(value):
+        if isinstance(value, torch.Tensor):
+            value = value.detach().cpu()
+            if value.is_floating_point():
+                value = value.to(getattr(torch, dtype))
+            value = value.numpy()
+        if isinstance(value, np.ndarray):
+            if value.dtype.kind == "f":
+                value = value.astype(dtype, copy=False)
+            arrays.append(np.ascontiguousarray(value).astype(value.dtype.newbyteorder("<"), copy=False))
+            return {"$tensor": len(arrays) - 1}
+        if isinstance(value, dict):
+            return {k: replace(v) for k, v in value.items()}
+        if isinstance(value, (list, tuple)):
+            return [replace(v) for v in value]
+        return value
+
+    data = replace(payload)
+
+    tensors = []
+    offset = 0
+    for arr in arrays:
+        offset = _align(offset)
+        tensors.append({
+            "dtype": arr.dtype.name,
+            "shape": list(arr.shape),
+            "offset": offset,
+            "nbytes": arr.nbytes,
+        })
+        offset += arr.nbytes
+
+    header = json.dumps({"data": data, "tensors": tensors}, separators=(",", ":")).encode()
+    # Pad so the buffer section starts 8-byte aligned within the whole message
+    header += b" " * (_align(len(header) + 8) - len(header) - 8)
+
+    out = bytearray(8 + len(header) + _align(offset))
+    out[0:4] = MAGIC
+    out[4:8] = struct.pack("<I", len(header))
+    out[8:8 + len(header)] = header
+    base = 8 + len(header)
+    for arr, info in zip(arrays, tensors):
+        start = base + info["offset"]
+        out[start:start + info["nbytes"]] = arr.tobytes()
+    return bytes(out)
+
+
+def decode_payload(buffer):
+    """Inverse of ``encode_payload``; tensors come back as numpy arrays"""
+    buffer = memoryview(buffer)
+    if bytes(buffer[0:4]) != MAGIC:
+        raise ValueError("Not an attention-lens tensor payload")
+    (header_len,) = struct.unpack("<I", buffer[4:8])
+    header = json.loads(bytes(buffer[8:8 + header_len]))
+    base = 8 + header_len
+
+    arrays = []
+    for info in header["tensors"]:
+        start = base + info["offset"]
+        arr = np.frombuffer(buffer[start:start + info["nbytes"]], dtype=np.dtype(info["dtype"]).newbyteorder("<"))
+        arrays.append(arr.reshape(info["shape"]))
+
+    def restore(value):
+        if isinstance(value, dict):
+            if set(value) == {"$tensor"}:
+                return arrays[value["$tensor"]]
+            return {k: restore(v) for k, v in value.items()}
+        if isinstance(value, list):
+            return [restore(v) for v in value]
+        return value
+
+    return restore(header["data"])
+
+
+def to_json_compatible(payload):
+    """Replace tensors / numpy arrays in a payload with nested lists for JSON responses"""
+    if isinstance(payload, torch.Tensor):
+        return payload.detach().cpu().numpy().tolist()
+    if isinstance(payload, np.ndarray):
+        return payload.tolist()
+    if isinstance(payload, dict):
+        return {k: to_json_compatible(v) for k, v in payload.items()}
+    if isinstance(payload, (list, tuple)):
+        return [to_json_compatible(v) for v in payload]
+    return payload
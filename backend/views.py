@@ -0,0 +1,89 @@
+"""Reduced views of attention patterns and activations for display.
+
+A full pattern is n_heads x T x T floats, most of them near zero and more
+than a heatmap can show. These helpers cut a tensor down before it is
+serialized: a subset of heads, ranges of positions, pooling into tiles, and
+a sparse CSR encoding that keeps only the largest or above-threshold
+entries of each row.
+"""
+import torch
+import torch.nn.functional as F
+
+POOL_MODES = ("mean", "max")
+
+
+def position_range(bounds, length: int, name: str):
+    """``[start, end)`` from an optional two-item list, checked against ``length``"""
+    if bounds is None:
+        return 0, length
+    if len(bounds) != 2 or not 0 <= bounds[0] < bounds[1] <= length:
+        raise ValueError(f"{name} must be [start, end) with 0 <= start < end <= {length}")
+    return bounds[0], bounds[1]
+
+
+def head_subset(heads, n_heads: int):
+    if heads is None:
+        return list(range(n_heads))
+    if not heads or any(h < 0 or h >= n_heads for h in heads):
+        raise ValueError(f"heads must be a non-empty list of head indices below {n_heads}")
+    return list(heads)
+
+
+def pool_last_dims(x: torch.Tensor, size: int, dims: int, mode: str = "mean"):
+    """Pool the last ``dims`` (1 or 2) dimensions of ``x`` in ``size``-wide tiles.
+
+    Edge tiles that are cut short are averaged over the entries they have.
+    """
+    if mode not in POOL_MODES:
+        raise ValueError(f"pool_mode must be one of {', '.join(POOL_MODES)}")
+    if size <= 1:
+        return x
+    lead = x.shape[:-dims]
+    flat = x.reshape(-1, *x.shape[-dims:]).float()
+    if dims == 2:
+        pool = F.avg_pool2d if mode == "mean" else F.max_pool2d
+    else:
+        pool = F.avg_pool1d if mode == "mean" else F.max_pool1d
+    pooled = pool(flat, size, stride=size, ceil_mode=True)
+    return pooled.reshape(*lead, *pooled.shape[1:])
+
+
+def to_csr(x: torch.Tensor, top_k: int = None, threshold: float = None):
+    """Sparse encoding of ``x`` [..., C] with one CSR row per vector along the last dimension.
+
+    A row keeps its ``top_k`` largest-magnitude entries and/or those with
+    magnitude at least ``threshold``. Exact zeros (such as the masked future
+    positions of a causal pattern) are never kept. Row r's entries are
+    ``values[indptr[r]:indptr[r + 1]]`` at columns
+    ``indices[indptr[r]:indptr[r + 1]]``, in ascending column order, where
+    rows are numbered in row-major order over all leading dimensions.
+    """
+    rows = x.reshape(-1, x.shape[-1])
+    magnitude = rows.abs()
+    keep = magnitude > 0
+    if top_k is not None and top_k < rows.shape[-1]:
+        top = torch.zeros_like(keep)
+        top.scatter_(1, magnitude.topk(top_k, dim=-1).indices, True)
+        keep &= top
+    if threshold is not None:
+        keep &= magnitude >= threshold
+
+    row_index, col_index = keep.nonzero(as_tuple=True)
+    indptr = torch.zeros(rows.shape[0] + 1, dtype=torch.int32)
+    indptr[1:] = keep.sum(-1).cumsum(0)
+    return {
+        "format": "csr",
+        "shape": list(x.shape),
+        "indptr": indptr,
+        "indices": col_index.to(torch.int32),
+        "values": rows[row_index, col_index],
+    }
+
+
+def encode_view(x: torch.Tensor, top_k: int = None, threshold: float = None):
+    """``x`` unchanged, or its CSR encoding when a sparsity option is set"""
+    if top_k is None and threshold is None:
+        return x
+    if top_k is not None and top_k < 1:
+        raise ValueError("row_top_k must be positive")
+    return to_csr(x, top_k, threshold)
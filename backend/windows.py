@@ -0,0 +1,50 @@
+import torch
+
+
+def window_spans(n_tokens: int, context_len: int, stride: int):
+    """Overlapping windows covering a sequence longer than the model context.
+
+    Returns ``(start, end, keep_from)`` tuples. Window k covers token
+    positions ``[start, end)``; positions ``[start + keep_from, end)`` are the
+    ones first covered by this window, so stitching the kept positions of
+    every window scores each token exactly once. After the first window every
+    kept position sees at least ``context_len - stride`` tokens of left context.
+    """
+    if n_tokens <= context_len:
+        return [(0, n_tokens, 0)]
+    stride = max(1, min(stride, context_len))
+
+    spans = []
+    covered = 0
+    start = 0
+    while covered < n_tokens:
+        # The last window is aligned to the end of the text for maximum context
+        start = min(start, n_tokens - context_len)
+        end = start + context_len
+        spans.append((start, end, covered - start))
+        covered = end
+        start += stride
+    return spans
+
+
+def iter_windows(model, ids, capture, stride: int = None, batch_size: int = 8):
+    """Run the model over ``ids`` in overlapping ``context_len`` windows.
+
+    Windows are forwarded ``batch_size`` at a time. Yields
+    ``(start, end, keep_from, outputs)`` in order, where ``outputs`` holds the
+    ``capture``d activations for that window with a batch dimension of 1.
+    """
+    context_len = model.context_len
+    if stride is None:
+        stride = context_len // 2
+    spans = window_spans(len(ids), context_len, stride)
+
+    for i in range(0, len(spans), batch_size):
+        chunk = spans[i:i + batch_size]
+        # Only a text shorter than the context yields a single short window,
+        # so windows in a chunk always share a length
+        x = torch.tensor([ids[start:end] for start, end, _ in chunk])
+        with torch.no_grad():
+            outputs = model(x, capture=capture)
+        for b, (start, end, keep_from) in enumerate(chunk):
+            yield start, end, keep_from, {name: t[b:b + 1] for name, t in outputs.items()}
@@ -8,7 +8,7 @@ import TokenSequence from './components/TokenSequence'
 import EigenvalueAnalysis from './components/EigenvalueAnalysis'
 import InContextLearning from './components/InContextLearning'
 import LogitLens from './components/LogitLens'
-import { predictNextToken, getAttention, getEmbeddings, getActivations, getWeights } from './api'
+import { analyze, getEmbeddings, getWeights } from './api'
 
 function App() {
   const [inputText, setInputText] = useState("The cat sat on the")
@@ -23,14 +23,10 @@ function App() {
   const fetchData = async () => {
     setLoading(true)
     try {
-      const [predRes, attnRes, actRes] = await Promise.all([
-        predictNextToken(inputText),
-        getAttention(inputText),
-        getActivations(inputText)
-      ])
-      setPredictions(predRes.predictions)
-      setAttentionData(attnRes)
-      setActivations(actRes)
+      const res = await analyze(inputText, ['predictions', 'attention', 'activations'])
+      setPredictions(res.predictions.predictions)
+      setAttentionData({ ...res.attention, tokens: res.tokens })
+      setActivations({ ...res.activations, tokens: res.tokens })
     } catch (error) {
       console.error("Error fetching data:", error)
     }
@@ -1,27 +1,59 @@
 import axios from 'axios';
+import { TENSOR_MEDIA_TYPE, decodeTensors, withNestedArrays } from './tensorFormat';
 
 const API_URL = 'http://localhost:4000';
 
+// POST to an endpoint that can return tensors in the compact binary format.
+// The buffers are decoded into typed arrays and then expanded to the same
+// nested arrays the JSON responses contain.
+const postTensors = async (path, body) => {
+        const response = await axios.post(`${API_URL}${path}`, body, {
+                headers: { Accept: TENSOR_MEDIA_TYPE },
+                responseType: 'arraybuffer',
+        });
+        return withNestedArrays(decodeTensors(response.data));
+};
+
 export const predictNextToken = async (text, top_k = 5) => {
         const response = await axios.post(`${API_URL}/predict`, { text, top_k });
         return response.data;
 };
 
-export const getAttention = async (text) => {
-        const response = await axios.post(`${API_URL}/attention`, { text });
-        return response.data;
+// options narrows the returned tensors: heads, positions / key_positions
+// ([start, end)), pool and pool_mode, and row_top_k / threshold for a sparse
+// CSR encoding (expand it with csrToDense from tensorFormat.js).
+export const getAttention = async (text, options = {}) => {
+        return postTensors('/attention', { text, ...options });
 };
 
-export const getEmbeddings = async () => {
-        const response = await axios.get(`${API_URL}/embeddings`);
+// One page of the 2D embedding projection. With fit = 'subset' the PCA is
+// fitted on the page itself; with 'vocab' every page shares the
+// full-vocabulary projection, so pages can be plotted together.
+export const getEmbeddings = async (offset = 0, limit = 1000, fit = 'subset') => {
+        const response = await axios.get(`${API_URL}/embeddings`, { params: { offset, limit, fit } });
         return response.data;
 };
 
-export const getActivations = async (text) => {
-        const response = await axios.post(`${API_URL}/activations`, { text });
+// Load the full-vocabulary projection incrementally, calling onPage with
+// each page of points as it arrives.
+export const loadAllEmbeddings = async (onPage, pageSize = 5000) => {
+        let offset = 0;
+        while (offset !== null) {
+                const data = await getEmbeddings(offset, pageSize, 'vocab');
+                onPage(data.embeddings, data.total);
+                offset = data.next_offset;
+        }
+};
+
+export const getEmbeddingSubset = async ({ token_ids = [], words = [], fit = 'subset' }) => {
+        const response = await axios.post(`${API_URL}/embeddings/subset`, { token_ids, words, fit });
         return response.data;
 };
 
+export const getActivations = async (text, options = {}) => {
+        return postTensors('/activations', { text, ...options });
+};
+
 export const getWeights = async () => {
         const response = await axios.get(`${API_URL}/weights`);
         return response.data;
@@ -51,3 +83,33 @@ export const getLogitLens = async (text, top_k = 5) => {
         const response = await axios.post(`${API_URL}/logit-lens`, { text, top_k });
         return response.data;
 };
+
+// Fetch several analyses of one prompt with a single request and forward pass.
+// Sections: predictions, attention, activations, token_predictions,
+// eigenvalues, induction, logit_lens
+export const analyze = async (text, sections, top_k = 5) => {
+        return postTensors('/analyze', { text, sections, top_k });
+};
+
+// Checkpoints that requests can select with a "model" field.
+export const listModels = async () => {
+        const response = await axios.get(`${API_URL}/models`);
+        return response.data;
+};
+
+// Attention deltas (pattern B - pattern A) and next-token prediction changes
+// between two checkpoints on the same prompt.
+export const compareModels = async (text, model_b, model_a = 'default', top_k = 10) => {
+        return postTensors('/compare', { text, model_a, model_b, top_k });
+};
+
+// Head behavior scores over many prompts, aggregated per head with
+// confidence intervals. prompts: { texts, token_ids } (either or both).
+export const sweepHeads = async (prompts, options = {}) => {
+        return postTensors('/induction-score/batch', { ...prompts, ...options });
+};
+
+// The same sweep on generated sequences of random tokens repeated `repeats` times.
+export const sweepRepeatedSequences = async (n_prompts = 100, length = 50, repeats = 2, options = {}) => {
+        return postTensors('/induction-score/repeated', { n_prompts, length, repeats, ...options });
+};
@@ -0,0 +1,110 @@
+// Decoder for the backend's compact tensor format (see backend/tensor_format.py).
+//
+// Layout: "ALT1" magic, uint32 LE header length, JSON header padded to 8 bytes,
+// then 8-byte aligned little-endian tensor buffers.
+
+export const TENSOR_MEDIA_TYPE = 'application/x-attention-lens-tensors';
+
+const float16ToFloat32 = (halves) => {
+        const out = new Float32Array(halves.length);
+        for (let i = 0; i < halves.length; i++) {
+                const h = halves[i];
+                const sign = h & 0x8000 ? -1 : 1;
+                const exponent = (h >> 10) & 0x1f;
+                const fraction = h & 0x03ff;
+                if (exponent === 0) {
+                        out[i] = sign * 2 ** -14 * (fraction / 1024);
+                } else if (exponent === 0x1f) {
+                        out[i] = fraction ? NaN : sign * Infinity;
+                } else {
+                        out[i] = sign * 2 ** (exponent - 15) * (1 + fraction / 1024);
+                }
+        }
+        return out;
+};
+
+const TYPED_ARRAYS = {
+        float32: Float32Array,
+        float64: Float64Array,
+        int8: Int8Array,
+        int16: Int16Array,
+        int32: Int32Array,
+        int64: BigInt64Array,
+        uint8: Uint8Array,
+        uint16: Uint16Array,
+        uint32: Uint32Array,
+        bool: Uint8Array,
+};
+
+// Returns the payload with every tensor replaced by { dtype, shape, data },
+// where data is a flat typed array (float16 is widened to Float32Array).
+export const decodeTensors = (arrayBuffer) => {
+        const view = new DataView(arrayBuffer);
+        const magic = String.fromCharCode(...new Uint8Array(arrayBuffer, 0, 4));
+        if (magic !== 'ALT1') {
+                throw new Error('Not an attention-lens tensor payload');
+        }
+        const headerLength = view.getUint32(4, true);
+        const header = JSON.parse(new TextDecoder().decode(new Uint8Array(arrayBuffer, 8, headerLength)));
+        const base = 8 + headerLength;
+
+        const tensors = header.tensors.map(({ dtype, shape, offset, nbytes }) => {
+                let data;
+                if (dtype === 'float16') {
+                        data = float16ToFloat32(new Uint16Array(arrayBuffer, base + offset, nbytes / 2));
+                } else {
+                        const TypedArray = TYPED_ARRAYS[dtype];
+                        data = new TypedArray(arrayBuffer, base + offset, nbytes / TypedArray.BYTES_PER_ELEMENT);
+                }
+                return { dtype: dtype === 'float16' ? 'float32' : dtype, shape, data };
+        });
+
+        const restore = (value) => {
+                if (Array.isArray(value)) return value.map(restore);
+                if (value && typeof value === 'object') {
+                        const keys = Object.keys(value);
+                        if (keys.length === 1 && keys[0] === '$tensor') return tensors[value.$tensor];
+                        return Object.fromEntries(keys.map(k => [k, restore(value[k])]));
+                }
+                return value;
+        };
+        return restore(header.data);
+};
+
+const isTensor = (value) => value && ArrayBuffer.isView(value.data) && Array.isArray(value.shape);
+
+// Convert a decoded tensor to nested plain arrays, matching the JSON response shape.
+export const toNestedArray = ({ shape, data }) => {
+        const build = (dim, offset) => {
+                if (dim === shape.length - 1) {
+                        return Array.from(data.subarray(offset, offset + shape[dim]), Number);
+                }
+                const stride = shape.slice(dim + 1).reduce((a, b) => a * b, 1);
+                return Array.from({ length: shape[dim] }, (_, i) => build(dim + 1, offset + i * stride));
+        };
+        return shape.length === 0 ? Number(data[0]) : build(0, 0);
+};
+
+// Replace every decoded tensor in a payload with nested arrays.
+export const withNestedArrays = (value) => {
+        if (isTensor(value)) return toNestedArray(value);
+        if (Array.isArray(value)) return value.map(withNestedArrays);
+        if (value && typeof value === 'object') {
+                return Object.fromEntries(Object.entries(value).map(([k, v]) => [k, withNestedArrays(v)]));
+        }
+        return value;
+};
+
+// Expand a sparse { format: 'csr', shape, indptr, indices, values } view
+// (as returned with row_top_k or threshold) to nested arrays, with zeros
+// for the entries that were dropped.
+export const csrToDense = ({ shape, indptr, indices, values }) => {
+        const columns = shape[shape.length - 1];
+        const data = new Float32Array(shape.reduce((a, b) => a * b, 1));
+        for (let row = 0; row < indptr.length - 1; row++) {
+                for (let j = indptr[row]; j < indptr[row + 1]; j++) {
+                        data[row * columns + indices[j]] = values[j];
+                }
+        }
+        return toNestedArray({ shape, data });
+};